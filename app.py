@@ -1,38 +1,290 @@
-from flask import Flask, render_template, redirect, flash, session, request, jsonify, g
+from flask import (Blueprint, Flask, Response, current_app, render_template, redirect, flash, session, request,
+                   jsonify, g, make_response, stream_with_context)
+from markupsafe import Markup
+from sqlalchemy import func, inspect, insert, select
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased, joinedload
 from forms import FlightForm, UserForm, LoginForm
-from models import db, Flight, Location, User
-from dotenv import load_dotenv
+from models import db, Flight, Location, User, FLIGHT_NATURAL_KEY
+from config import get_config
+from database import init_db
+from token_manager import TokenManager
+from upstream import UpstreamClient, RateLimiter
+from cache import make_cache, MemoryCache
+from singleflight import SingleFlight, FileLocks
+from weather import WeatherService, parse_request
+from search_store import make_search_store
+from identity import IdentityCache
+from location_index import LocationIndex, LocationEntry, normalize
+from offers import OFFER_FORMAT, dedupe_offers, parse_duration
+from flex_search import FlexSearch, MAX_FLEX_DAYS, date_grid
+from hashing import hasher, HashingBusy, LoginThrottle
+from metrics import metrics
+from http_cache import compressor, static_assets, template_version
+from fx import FxRates, format_money, from_minor, is_currency_code, parse_amount
+from datetime import date, datetime, timedelta
+import asyncio
+import click
+import csv
+import hashlib
+import io
+import json
+import threading
 import requests
 import os
+import time
 
 CURR_USER_KEY = "curr_user"
 
-# Initialize Flask app
-app = Flask(__name__)
+# Endpoints that never look at g.user, so the user lookup is skipped for them
+USERLESS_ENDPOINTS = {'static', 'main.get_token', 'main.get_weather', 'main.api_search', 'main.suggest_locations',
+                      'main.flex_search_stream', 'main.metrics_endpoint'}
+SAVED_FLIGHTS_PAGE_SIZE = 20
+SAVED_FLIGHT_SORTS = ('newest', 'price', 'duration', 'stops')
+MAX_BATCH_SIZE = 100
+EXPORT_BATCH_SIZE = 500
+EXPORT_COLUMNS = ('id', 'flight_id', 'origin', 'destination', 'depart_date', 'return_date', 'passengers', 'num_stops',
+                  'duration_minutes', 'price', 'currency', 'current_price', 'price_checked_at')
 
-# Config settings
+# All routes and CLI commands; create_app() registers it. cli_group=None keeps commands at `flask <name>`
+bp = Blueprint('main', __name__, cli_group=None)
 
-app.config['FLASK_ENV'] = os.getenv('FLASK_ENV', 'development')
-if app.debug or os.getenv('FLASK_ENV') == 'development':
-    load_dotenv('environment.env')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-CLIENT_ID = os.getenv('CLIENT_ID')
-CLIENT_SECRET = os.getenv('CLIENT_SECRET')
-WEATHER_TOKEN = os.getenv('WEATHER_TOKEN')
+def services():
+    """The current app's Services."""
+    return current_app.extensions['flightcast']
 
-# Init SQLAlchemy
-db.init_app(app)
 
-try:
-    from seed import seed_database
-    seed_database(app)
-except Exception as e:
-    print(f"Error seeding the database: {e}")
+class Services:
+    """Settings, upstream client, caches and limiters of one app, shared by every request in the worker.
+
+    init_services() builds one from the app config and keeps it in
+    app.extensions, so a second app in the same process gets its own. The
+    fetch methods also run on the flex-search and fx-refresh threads, where
+    there is no app context, so they only use what is kept here.
+    """
+
+    def __init__(self, config):
+        self.client_id = config['CLIENT_ID']
+        self.client_secret = config['CLIENT_SECRET']
+        self.weather_token = config['WEATHER_TOKEN']
+        self.amadeus_base_url = config['AMADEUS_BASE_URL']
+        self.weather_base_url = config['WEATHER_BASE_URL']
+        self.exchange_rate_base_url = config['EXCHANGE_RATE_BASE_URL']
+        self.display_currency = config['DISPLAY_CURRENCY']
+
+        # Airport/city autocomplete index, loaded on first use from data/airports.csv and the locations table
+        self.location_index = LocationIndex()
+        self.location_index_lock = threading.Lock()
+        # Queries already sent upstream, so index misses are not re-fetched on every keystroke
+        self.location_lookups = MemoryCache(ttl=60 * 60, max_entries=5000)
+
+        # Logged-in user's id/username/email, cached briefly so most requests skip the users table
+        self.identity_cache = IdentityCache(ttl=config['IDENTITY_CACHE_TTL'])
+
+        # Search context between the results page and save_flight(); 'memory' or 'sqlite' keep it out of the cookie
+        self.search_store = make_search_store(
+            config['SEARCH_STORE'],
+            path=config['SEARCH_CACHE_PATH'],
+            ttl=config['SEARCH_STORE_TTL'])
+
+        # Keep-alive connection pool shared by every upstream call in this worker
+        self.upstream = UpstreamClient(
+            pool_size=config['UPSTREAM_POOL_SIZE'],
+            connect_timeout=config['UPSTREAM_CONNECT_TIMEOUT'],
+            read_timeout=config['UPSTREAM_READ_TIMEOUT'],
+            retries=config['UPSTREAM_RETRIES'],
+            backoff=config['UPSTREAM_BACKOFF'])
+
+        # One Amadeus token per client id, shared by every request in this worker
+        self.token_manager = TokenManager(self.upstream,
+                                          token_url=f"{self.amadeus_base_url}/v1/security/oauth2/token")
+
+        # Amadeus allows 10 requests/second in the test environment; every flight-offers call in this worker takes a token
+        self.amadeus_limiter = RateLimiter(rate=config['AMADEUS_RATE_LIMIT'], burst=config['AMADEUS_RATE_BURST'])
+        self.amadeus_rate_wait = config['AMADEUS_RATE_WAIT']
+
+        # Filtered flight-offer results keyed by normalized search; use the sqlite backend to share across workers
+        self.search_cache = make_cache(
+            config['SEARCH_CACHE_BACKEND'],
+            path=config['SEARCH_CACHE_PATH'],
+            ttl=config['SEARCH_CACHE_TTL'],
+            max_entries=config['SEARCH_CACHE_MAX_ENTRIES'],
+            max_bytes=config['SEARCH_CACHE_MAX_BYTES'])
+
+        # Rendered result lists, so a repeat view of a cached search skips the template
+        self.fragment_cache = MemoryCache(
+            ttl=config['SEARCH_CACHE_TTL'],
+            max_entries=config['SEARCH_CACHE_MAX_ENTRIES'],
+            max_bytes=config['SEARCH_CACHE_MAX_BYTES'])
+
+        # Concurrent identical searches wait for one upstream call; SEARCH_LOCK_DIR extends that to every worker
+        self.search_coalescer = SingleFlight(
+            wait=config['SEARCH_COALESCE_WAIT'],
+            locks=FileLocks(config['SEARCH_LOCK_DIR']) if config['SEARCH_LOCK_DIR'] else None)
+
+        # Failed password checks per username; the sqlite backend shares the count between workers
+        self.login_throttle = LoginThrottle(
+            max_failures=config['LOGIN_MAX_FAILURES'],
+            cache=make_cache(config['LOGIN_THROTTLE_BACKEND'],
+                             path=config['SEARCH_CACHE_PATH'],
+                             ttl=config['LOGIN_THROTTLE_WINDOW'],
+                             max_entries=100000))
+
+        # Date-grid searches share one small pool per worker; cached dates are answered without touching it
+        self.flex_search = FlexSearch(
+            self.search_flights,
+            self.cached_flights,
+            max_workers=config['FLEX_SEARCH_WORKERS'],
+            timeout=config['FLEX_SEARCH_TIMEOUT'])
+
+        self.weather_service = WeatherService(self.fetch_weather, MemoryCache(
+            ttl=config['WEATHER_CACHE_TTL'],
+            max_entries=config['WEATHER_CACHE_MAX_ENTRIES'],
+            max_bytes=config['WEATHER_CACHE_MAX_BYTES']))
+
+        # Prices are stored in the currency they were offered in and converted for display with this table
+        self.fx_rates = FxRates(self.fetch_exchange_rates, base='EUR', ttl=config['FX_REFRESH_INTERVAL'])
+
+    def register_metrics(self):
+        """Export these services' stats at /metrics; the registry is per process, so the last app registered wins."""
+        metrics.add_histogram_collector('upstream_duration_seconds', 'endpoint', self.upstream.stats)
+        metrics.add_collector('cache', self.search_cache.stats, cache='search')
+        metrics.add_collector('cache', self.fragment_cache.stats, cache='fragments')
+        metrics.add_collector('compression', compressor.stats)
+        metrics.add_collector('singleflight', self.search_coalescer.stats, call='flight_offers')
+        metrics.add_collector('cache', self.weather_service.stats, cache='weather')
+        metrics.add_collector('cache', self.location_lookups.stats, cache='location_lookups')
+        metrics.add_collector('identity_cache', self.identity_cache.stats)
+        metrics.add_collector('location_index', lambda: {'hits': self.location_index.hits,
+                                                         'misses': self.location_index.misses,
+                                                         'entries': len(self.location_index)})
+        metrics.add_collector('amadeus_token', self.token_manager.stats)
+        metrics.add_collector('rate_limiter', self.amadeus_limiter.stats, upstream='amadeus')
+        metrics.add_collector('flex_search_cells', self.flex_search.stats)
+        metrics.add_collector('login_throttle', self.login_throttle.stats)
+        metrics.add_collector('fx_rates', self.fx_rates.stats)
+
+    def fetch_token(self):
+        """Get a cached token for the API, refreshing it when close to expiry."""
+        return self.token_manager.get_token(self.client_id, self.client_secret)
+
+    def cached_flights(self, params):
+        """The cached flights for a search, or None without calling upstream."""
+        return self.search_cache.get(search_cache_key(params))
+
+    def search_flights(self, params):
+        """Return deduplicated flights for a search, from the cache when possible.
+
+        Identical searches that miss the cache at the same time share one upstream call.
+        """
+        key = search_cache_key(params)
+        flight_data = self.search_cache.get(key)
+        if flight_data is None:
+            flight_data = self.search_coalescer.do(key, lambda: self.load_flights(key, params),
+                                                   lambda: self.search_cache.get(key))
+        return flight_data
+
+    def load_flights(self, key, params):
+        """Fetch and deduplicate the flights for a search and cache them."""
+        response = self.fetch_flights(params)
+        if response is None:
+            return None
+        try:
+            with response:
+                flight_data = {"data": tuple(dedupe_offers(response.raw, params['originLocationCode'])),
+                               "fetched_at": time.time()}
+        except Exception as e:
+            print(f"Failed to read flights: {e}")
+            return None
+        self.search_cache.set(key, flight_data)
+        return flight_data
+
+    def fetch_flights(self, params):
+        """Fetch flights, returning the streamed response so the body can be parsed incrementally."""
+        url = f"{self.amadeus_base_url}/v2/shopping/flight-offers"
+        token = self.fetch_token()
+        if not token:
+            print("Failed to fetch flights.")
+            return None
+        if not self.amadeus_limiter.acquire(timeout=self.amadeus_rate_wait):
+            print("Failed to fetch flights: rate limit wait exceeded.")
+            return None
+        try:
+            response = self.upstream.get('flight_offers', url, params=params, stream=True,
+                                         headers={"Authorization": f"Bearer {token}"})
+            if response.status_code == 401:
+                # Token was revoked or expired early, get a fresh one and retry once
+                response.close()
+                self.token_manager.invalidate(self.client_id)
+                token = self.fetch_token()
+                if token and self.amadeus_limiter.acquire(timeout=self.amadeus_rate_wait):
+                    response = self.upstream.get('flight_offers', url, params=params, stream=True,
+                                                 headers={"Authorization": f"Bearer {token}"})
+        except requests.RequestException as e:
+            print(f"Failed to fetch flights: {e}")
+            return None
+        if response.status_code == 200:
+            # Let urllib3 undo any gzip encoding while the body is streamed
+            response.raw.decode_content = True
+            return response
+        else:
+            response.close()
+            print("Failed to fetch flights.")
+            return None
+
+    def fetch_weather(self, lat_long, start, end):
+        """Fetch daily weather for a location and date range."""
+        url = f"{self.weather_base_url}/VisualCrossingWebServices/rest/services/timeline/{lat_long}/{start}/{end}"
+        params = {'unitGroup': 'us', 'include': 'days', 'key': self.weather_token, 'contentType': 'json'}
+        try:
+            response = self.upstream.get('weather_timeline', url, params=params)
+        except requests.RequestException as e:
+            print(f"Failed to fetch weather: {e}")
+            return None
+        if response.status_code == 200:
+            return response.json()
+        else:
+            print("Failed to fetch weather.")
+            return None
+
+    def fetch_exchange_rates(self, base='EUR'):
+        """Fetch the rate table from `base` to every currency; fx_rates calls this when its table is due."""
+        url = f"{self.exchange_rate_base_url}/v4/latest/{base}"
+        try:
+            response = self.upstream.get('exchange_rate', url)
+        except requests.RequestException as e:
+            print(f"Failed to fetch exchange rate: {e}")
+            return None
+        if response.status_code == 200:
+            return response.json().get('rates')
+        else:
+            print("Failed to fetch exchange rate.")
+            return None
+
+    def fetch_locations(self, keyword):
+        """Fetch airports and cities matching keyword."""
+        url = f"{self.amadeus_base_url}/v1/reference-data/locations"
+        token = self.fetch_token()
+        if not token:
+            return None
+        try:
+            response = self.upstream.get('locations', url, params={'subType': 'CITY,AIRPORT', 'keyword': keyword},
+                                         headers={"Authorization": f"Bearer {token}"})
+        except requests.RequestException as e:
+            print(f"Failed to fetch locations: {e}")
+            return None
+        if response.status_code == 200:
+            return [item for item in response.json().get('data', [])
+                    if item.get('iataCode') and item.get('geoCode')]
+        else:
+            print("Failed to fetch locations.")
+            return None
+
+
+def init_services(app):
+    """Build the app's upstream client, caches and limiters from its config, as app.extensions['flightcast']."""
+    app.extensions['flightcast'] = Services(app.config)
+    app.extensions['flightcast'].register_metrics()
 
 
 def safe_commit():
@@ -54,54 +306,156 @@ def flash_form_errors(form):
             flash(f'{field.capitalize()}: {error}', 'danger')
 
 
-@app.route('/', methods=['GET'])
+@bp.route('/', methods=['GET'])
 def home():
-    """Show homepage and list of saved flights if logged in."""
-    fetch_token()
+    """Show homepage and list of saved flights if logged in.
+
+    The page carries an ETag, so a browser that has it answers its revalidation with a 304.
+    """
     session.pop('search_results', None)
-    form = FlightForm()
-    if g.user:
-        saved_flights = Flight.query.filter_by(
-            user_id=g.user.id).order_by(Flight.id.desc()).all()
+    etag = home_etag()
+    if etag and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
     else:
-        saved_flights = []
-    return render_template('home.html', form=form, saved_flights=saved_flights)
+        form = FlightForm()
+        if g.user:
+            saved_flights, next_before = saved_flights_page(g.user.id)
+        else:
+            saved_flights, next_before = [], None
+        response = make_response(render_template('home.html', form=form, saved_flights=saved_flights,
+                                                 next_before=next_before))
+    if etag:
+        # Weak: the CSRF token in the form differs between renders
+        response.set_etag(etag, weak=True)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response
 
 
-def fetch_token():
-    """Request token from API"""
-    token_url = 'https://test.api.amadeus.com/v1/security/oauth2/token'
-    payload = {
-        'grant_type': 'client_credentials',
-        'client_id': CLIENT_ID,
-        'client_secret': CLIENT_SECRET
-    }
-    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-    response = requests.post(token_url, data=payload, headers=headers)
-    if response.status_code == 200:
-        session["token"] = response.json().get('access_token')
-        return session["token"]
-    else:
-        print("Failed to get token")
+def home_etag():
+    """ETag of the home page, or None when it has to be rendered anyway.
+
+    It changes when the user saves or deletes a flight, the exchange rates
+    change, or the CSRF token in the cached form is halfway to expiring.
+    """
+    csrf_secret = session.get('csrf_token')
+    if not csrf_secret or '_flashes' in session:
         return None
+    parts = [template_version(current_app, 'home.html', 'base.html'), csrf_secret, services().display_currency,
+             services().fx_rates.version()]
+    time_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    if time_limit:
+        parts.append(int(time.time() // (time_limit / 2)))
+    if g.user:
+        # Latest id and count together catch saves and deletes, from the user_id/id index alone
+        latest, count = (db.session.query(func.max(Flight.id), func.count(Flight.id))
+                         .filter(Flight.user_id == g.user.id).one())
+        parts += [g.user.id, g.user.username, latest, count]
+    return hashlib.sha1('|'.join(map(str, parts)).encode('utf-8')).hexdigest()
 
 
-@app.route('/token', methods=["GET"])
+@bp.route('/flights', methods=['GET'])
+def list_flights():
+    """List saved flights as JSON, one page at a time.
+
+    ?sort=newest (the default) pages with ?before=<id>; ?sort=price, duration
+    or stops page with ?offset=<n>. Price is converted to the display currency.
+    ?max_price=<amount>, ?max_duration=<minutes> and ?max_stops=<n> filter.
+    """
+    if not g.user:
+        return jsonify({"status": "failure", "message": "User not authenticated"}), 401
+    sort = request.args.get('sort', 'newest')
+    if sort not in SAVED_FLIGHT_SORTS:
+        return jsonify({"error": f"sort must be one of {', '.join(SAVED_FLIGHT_SORTS)}"}), 400
+    max_price = request.args.get('max_price')
+    try:
+        max_price_minor = parse_amount(max_price, services().display_currency) if max_price else None
+    except ValueError:
+        return jsonify({"error": "max_price must be a non-negative number"}), 400
+    before_id = request.args.get('before', type=int)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(request.args.get('limit', SAVED_FLIGHTS_PAGE_SIZE, type=int), 100)
+    try:
+        flights, next_page = saved_flights_page(
+            g.user.id, before_id, max(limit, 1), sort=sort, offset=offset, max_price_minor=max_price_minor,
+            max_duration=request.args.get('max_duration', type=int),
+            max_stops=request.args.get('max_stops', type=int))
+    except LookupError:
+        return jsonify({"error": "Exchange rates are unavailable, try again later"}), 503
+    page = {"flights": [serialize_saved_flight(flight) for flight in flights]}
+    page["next_before" if sort == 'newest' else "next_offset"] = next_page
+    return jsonify(page)
+
+
+def serialize_saved_flight(flight):
+    """A saved flight with its price, duration, stops and dates formatted for display."""
+    return dict(flight.serialize(),
+                display_price=display_price(flight.price_minor, flight.currency),
+                display_duration=format_duration(flight.duration_minutes),
+                display_stops=format_stops(flight.num_stops),
+                display_dates=f'{format_time(flight.depart_date)} - {format_time(flight.return_date)}')
+
+
+def saved_flights_query(user_id, before_id=None, limit=SAVED_FLIGHTS_PAGE_SIZE, sort='newest', offset=0,
+                        max_price_minor=None, max_duration=None, max_stops=None):
+    query = (Flight.query
+             .options(joinedload(Flight.departure_location, innerjoin=True),
+                      joinedload(Flight.arrival_location, innerjoin=True))
+             .filter(Flight.user_id == user_id))
+    if max_duration is not None:
+        query = query.filter(Flight.duration_minutes <= max_duration)
+    if max_stops is not None:
+        query = query.filter(Flight.num_stops <= max_stops)
+    if max_price_minor is not None or sort == 'price':
+        # Converted in SQL with this worker's rate table, so flights saved in different currencies compare
+        base_price = services().fx_rates.sql_to_base(Flight.price_minor, Flight.currency)
+    if max_price_minor is not None:
+        display_currency = services().display_currency
+        max_base_price = services().fx_rates.to_base(max_price_minor, display_currency)
+        if max_base_price is None:
+            raise LookupError(f'no exchange rate for {display_currency}')
+        query = query.filter(base_price <= max_base_price)
+    if sort == 'price':
+        return query.order_by(base_price.asc().nulls_last(), Flight.id).offset(offset).limit(limit)
+    if sort == 'duration':
+        # ix_flights_user_id_duration_minutes
+        return query.order_by(Flight.duration_minutes, Flight.id).offset(offset).limit(limit)
+    if sort == 'stops':
+        # ix_flights_user_id_num_stops
+        return query.order_by(Flight.num_stops, Flight.id).offset(offset).limit(limit)
+    if before_id:
+        query = query.filter(Flight.id < before_id)
+    return query.order_by(Flight.id.desc()).limit(limit)
+
+
+def saved_flights_page(user_id, before_id=None, limit=SAVED_FLIGHTS_PAGE_SIZE, sort='newest', offset=0, **filters):
+    """Load a page of saved flights with both locations in a single query.
+
+    Newest-first pages are keyed on Flight.id: pass the returned cursor as
+    `before_id` to get the next page. Other sorts return the next `offset`
+    instead. The cursor is None on the last page. `filters` are the max_*
+    arguments of saved_flights_query().
+    """
+    flights = saved_flights_query(user_id, before_id, limit + 1, sort, offset, **filters).all()
+    if len(flights) <= limit:
+        return flights, None
+    next_page = flights[limit - 1].id if sort == 'newest' else offset + limit
+    return flights[:limit], next_page
+
+
+@bp.route('/token', methods=["GET"])
 def get_token():
     """Get token for API"""
-    token = session.get('token')
+    token = services().fetch_token()
     if not token:
-        token = fetch_token()
-        if not token:
-            return jsonify({"error": "Failed to fetch token"}), 400
-        session['token'] = token
-    return jsonify({"token": token, "weather_token": WEATHER_TOKEN})
+        return jsonify({"error": "Failed to fetch token"}), 400
+    return jsonify({"token": token})
 
 ######################################################################################################################
 # Flight search/show/save/delete
 
 
-@app.route('/submit', methods=['GET', 'POST'])
+@bp.route('/submit', methods=['GET', 'POST'])
 def submit_search():
     """Handle flight search form submission and server-side validation"""
     form = FlightForm()
@@ -114,67 +468,206 @@ def submit_search():
             'adults': form.passengers.data,
             'max': 25
         }
-        flight_data = fetch_flights(flight_form_data)
-        departure_name = form.departure_name.data
-        arrival_name = form.arrival_name.data
-        departure_iatacode = form.departure_iatacode.data
-        departure_lat = form.departure_lat.data
-        departure_long = form.departure_long.data
-        arrival_iatacode = form.arrival_iatacode.data
-        arrival_lat = form.arrival_lat.data
-        arrival_long = form.arrival_long.data
-        depart_date = form.depart_date.data
-        return_date = form.return_date.data
-        passengers = form.passengers.data
-        session['departure_name'] = departure_name
-        session['departure_iatacode'] = departure_iatacode
-        session['departure_lat'] = departure_lat
-        session['departure_long'] = departure_long
-        session['arrival_name'] = arrival_name
-        session['arrival_iatacode'] = arrival_iatacode
-        session['arrival_lat'] = arrival_lat
-        session['arrival_long'] = arrival_long
-        session['depart_date'] = depart_date
-        session['return_date'] = return_date
-        session['passengers'] = passengers
+        flex_days = min(int(form.flex_days.data or 0), MAX_FLEX_DAYS)
+        search_id = services().search_store.save({
+            'departure_name': form.departure_name.data,
+            'departure_iatacode': form.departure_iatacode.data,
+            'departure_lat': form.departure_lat.data,
+            'departure_long': form.departure_long.data,
+            'arrival_name': form.arrival_name.data,
+            'arrival_iatacode': form.arrival_iatacode.data,
+            'arrival_lat': form.arrival_lat.data,
+            'arrival_long': form.arrival_long.data,
+            'depart_date': form.depart_date.data.isoformat(),
+            'return_date': form.return_date.data.isoformat(),
+            'passengers': form.passengers.data,
+            'flex_days': flex_days
+        })
+        if flex_days:
+            # The price matrix is filled in by the page from /search/flex as the dates complete
+            grid = date_grid(form.depart_date.data, form.return_date.data, flex_days)
+            return render_template('flex_results.html',
+                                   form=form,
+                                   search_id=search_id,
+                                   depart_dates=sorted({depart for depart, _ in grid}),
+                                   return_dates=sorted({ret for _, ret in grid}),
+                                   grid=set(grid),
+                                   departure_name=form.departure_name.data,
+                                   departure_iatacode=form.departure_iatacode.data,
+                                   arrival_name=form.arrival_name.data,
+                                   arrival_iatacode=form.arrival_iatacode.data)
+        flight_data = services().search_flights(flight_form_data)
         if flight_data:
-            flight_data = filter_flights(flight_data, departure_iatacode)
             return render_template('search_results.html',
-                                   flight_data=flight_data,
-                                   departure_name=departure_name,
-                                   departure_iatacode=departure_iatacode,
-                                   arrival_name=arrival_name,
-                                   arrival_iatacode=arrival_iatacode)
+                                   flight_results=render_flight_results(search_cache_key(flight_form_data),
+                                                                        flight_data),
+                                   search_id=search_id,
+                                   departure_name=form.departure_name.data,
+                                   departure_iatacode=form.departure_iatacode.data,
+                                   arrival_name=form.arrival_name.data,
+                                   arrival_iatacode=form.arrival_iatacode.data)
     return redirect('/')
 
 
-def fetch_flights(params):
-    """Fetch flights."""
-    url = "https://test.api.amadeus.com/v2/shopping/flight-offers"
-    headers = {"Authorization": f"Bearer {session['token']}"}
-    response = requests.get(url, params=params, headers=headers)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print("Failed to fetch flights.")
-        return None
+@bp.route('/search/flex')
+def flex_search_stream():
+    """Stream the price matrix of a flexible-date search as newline-delimited JSON, one date pair per line."""
+    search = services().search_store.load(request.args.get('search_id'))
+    if not search or not search.get('flex_days'):
+        return jsonify({"error": "Search not found"}), 404
+    params = {
+        'originLocationCode': search['departure_iatacode'],
+        'destinationLocationCode': search['arrival_iatacode'],
+        'departureDate': date.fromisoformat(search['depart_date']),
+        'returnDate': date.fromisoformat(search['return_date']),
+        'adults': search['passengers'],
+        'max': 25
+    }
+
+    flex_search = services().flex_search
+
+    def generate():
+        for cell in flex_search.run(params, search['flex_days']):
+            if cell['status'] == 'ok':
+                cell['display_price'] = display_price(cell['price_minor'], cell['currency'])
+            yield json.dumps(cell) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'})
+
 
+def render_flight_results(key, flight_data):
+    """The rendered result list of a search, cached under its search cache key.
 
-def filter_flights(flights, iatacode):
-    """Remove duplicate flights."""
-    seen = set()
-    filter_flights = []
-    for flight in flights['data']:
-        flight_number = flight['itineraries'][0]['segments'][0]['number']
-        departure_iatacode = flight['itineraries'][0]['segments'][0]['departure']['iataCode']
-        if flight_number not in seen and departure_iatacode == iatacode:
-            filter_flights.append(flight)
-            seen.add(flight_number)
+    The fragment key also covers when the offers were fetched, the template,
+    the exchange rates and whether the Save buttons are shown, so a changed
+    input renders it afresh.
+    """
+    app_services = services()
+    fragment_key = ':'.join(map(str, (
+        key, 'html', flight_data.get('fetched_at'), template_version(current_app, 'flight_results.html'),
+        app_services.display_currency, app_services.fx_rates.version(), int(bool(g.user)))))
+    html = app_services.fragment_cache.get(fragment_key)
+    if html is None:
+        html = render_template('flight_results.html', flight_data=flight_data)
+        app_services.fragment_cache.set(fragment_key, html)
+    return Markup(html)
 
-    return {"data": filter_flights}
+
+def search_cache_key(params):
+    """Normalize search params into a cache key."""
+    return 'flights:v{}:{}:{}:{}:{}:{}:{}'.format(
+        OFFER_FORMAT,
+        params['originLocationCode'].strip().upper(),
+        params['destinationLocationCode'].strip().upper(),
+        params['departureDate'],
+        params['returnDate'],
+        int(params['adults']),
+        int(params['max']))
+
+
+@bp.app_template_global()
+def display_price(amount_minor, currency):
+    """Format a price in the display currency, or in its own currency when there is no rate for it."""
+    display_currency = services().display_currency
+    converted = services().fx_rates.convert(amount_minor, currency, display_currency)
+    if converted is None:
+        return format_money(amount_minor, currency)
+    return format_money(converted, display_currency)
+
+
+@bp.app_template_filter()
+def format_duration(minutes):
+    """850 -> '14 hr 10 min'."""
+    if minutes is None:
+        return 'Unknown'
+    return f'{minutes // 60} hr {minutes % 60} min'
+
+
+@bp.app_template_filter()
+def format_time(value):
+    """A datetime or ISO 8601 timestamp as 'Oct 21, 2023, 1:03 PM'."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    hour = value.hour % 12 or 12
+    return f"{value:%b} {value.day}, {value.year}, {hour}:{value.minute:02d} {'PM' if value.hour >= 12 else 'AM'}"
+
+
+@bp.app_template_filter()
+def format_stops(num_stops):
+    return 'Non-stop' if num_stops == 0 else str(num_stops)
+
+
+@bp.app_template_global()
+def offer_price(offer):
+    """Display price of an offers.Offer."""
+    return display_price(offer.price_minor, offer.currency)
+
+
+# Daily weather per rounded location, shared by the search page, saved flights and /api/search
+@bp.route('/weather', methods=['GET', 'POST'])
+def get_weather():
+    """Get daily weather for one location (GET) or a batch of flights (POST)."""
+    if request.method == 'GET':
+        try:
+            query = parse_request(request.args['lat_long'], request.args['start'], request.args['end'])
+        except (KeyError, ValueError):
+            return jsonify({"error": "lat_long, start and end are required"}), 400
+        weather = services().weather_service.get(*query)
+        if not weather:
+            return jsonify({"error": "Failed to fetch weather"}), 502
+        return jsonify(weather)
+
+    items = (request.get_json(silent=True) or {}).get('requests')
+    if not isinstance(items, list) or len(items) > 100:
+        return jsonify({"error": "Expected a list of at most 100 requests"}), 400
+    try:
+        queries = [parse_request(item['lat_long'], item['start'], item['end']) for item in items]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Each request needs lat_long, start and end"}), 400
+    return jsonify({"results": services().weather_service.get_many(queries)})
+
+
+@bp.route('/api/search', methods=['GET', 'POST'])
+async def api_search():
+    """Search flights, destination weather and the EUR to display currency rate concurrently."""
+    args = request.get_json(silent=True) or request.args
+    try:
+        origin = args['origin'].strip().upper()
+        destination = args['destination'].strip().upper()
+        depart_date = date.fromisoformat(args['depart_date'])
+        return_date = date.fromisoformat(args['return_date'])
+        adults = int(args.get('adults', 1))
+        lat, long = args.get('arrival_lat'), args.get('arrival_long')
+        location = (float(lat), float(long)) if lat and long else None
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return jsonify({"error": "origin, destination, depart_date and return_date are required"}), 400
+    if not 1 <= adults <= 9 or return_date <= depart_date:
+        return jsonify({"error": "Invalid dates or number of passengers"}), 400
+
+    params = {
+        'originLocationCode': origin,
+        'destinationLocationCode': destination,
+        'departureDate': depart_date,
+        'returnDate': return_date,
+        'adults': adults,
+        'max': 25
+    }
+    app_services = services()
+    weather_task = (asyncio.to_thread(app_services.weather_service.get, *location, depart_date, return_date)
+                    if location else asyncio.sleep(0))
+    flight_data, weather, exchange_rate = await asyncio.gather(
+        asyncio.to_thread(app_services.search_flights, params),
+        weather_task,
+        asyncio.to_thread(app_services.fx_rates.rate, 'EUR', app_services.display_currency))
+    return jsonify({
+        "flights": {"data": [offer.serialize() for offer in flight_data['data']]} if flight_data else None,
+        "weather": weather,
+        "exchange_rate": {"base": "EUR", "target": app_services.display_currency, "rate": exchange_rate}
+    })
 
 
-@app.route('/save_flight', methods=['POST'])
+@bp.route('/save_flight', methods=['POST'])
 def save_flight():
     """Save selected flight to the database."""
     flight_details = request.json  # Assuming data is sent as JSON in the request
@@ -182,53 +675,193 @@ def save_flight():
         return jsonify({"status": "failure", "message": "User not authenticated"})
 
     if flight_details:
-        location_departure = get_location(session['departure_iatacode'])
-        location_arrival = get_location(session['arrival_iatacode'])
-
-        if not location_departure:
-            location_departure = create_location(
-                session['departure_name'], session['departure_iatacode'], session['departure_lat'], session['departure_long'])
-
-        if not location_arrival:
-            location_arrival = create_location(
-                session['arrival_name'], session['arrival_iatacode'], session['arrival_lat'], session['arrival_long'])
-
-        existing_flight = Flight.query.filter_by(
-            flight_id=flight_details['flight_id'],
-            departure_location=location_departure,
-            arrival_location=location_arrival,
-            depart_date=session['depart_date'],
-            return_date=session['return_date'],
-            passengers=session['passengers'],
-            num_stops=flight_details['numStopsValue'],
-            total_duration=flight_details['durationValue'],
-            price=flight_details['priceValue'],
-            user_id=g.user.id
-        ).first()
-
-        if existing_flight:
-            return jsonify({"status": "failure", "message": "Similar flight already exists for the user"})
+        search = services().search_store.load(flight_details.get('search_id'))
+        if not search:
+            return jsonify({"status": "failure", "message": "Search expired, please search again"})
+        try:
+            row = saved_flight_row(flight_details, search)
+        except ValueError as e:
+            return jsonify({"status": "failure", "message": str(e)}), 400
 
+        location_departure, location_arrival = search_locations(search)
         new_flight = Flight(
-            flight_id=flight_details['flight_id'],
-            departure_location=location_departure,
-            arrival_location=location_arrival,
-            depart_date=session['depart_date'],
-            return_date=session['return_date'],
-            passengers=session['passengers'],
-            num_stops=flight_details['numStopsValue'],
-            total_duration=flight_details['durationValue'],
-            price=flight_details['priceValue'],
-            user_id=g.user.id
+            departure_location_id=location_departure.id,
+            arrival_location_id=location_arrival.id,
+            user_id=g.user.id,
+            **row
         )
 
-        db.session.add(new_flight)
+        # The unique natural-key index rejects duplicates, no need to look them up first
+        try:
+            with db.session.begin_nested():
+                db.session.add(new_flight)
+        except IntegrityError:
+            return jsonify({"status": "failure", "message": "Similar flight already exists for the user"})
         safe_commit()
         return jsonify({"status": "success", "message": "Flight saved"})
     else:
         return jsonify({"status": "failure", "message": "No data received in the request"})
 
 
+@bp.route('/flights/batch', methods=['POST'])
+def save_flights_batch():
+    """Save several results of one search in a single transaction.
+
+    Takes {"search_id": ..., "flights": [...]}, each flight shaped like a
+    /save_flight body. Nothing is saved if any flight is invalid. Flights the
+    user already saved are skipped, found with one query for the whole batch.
+    """
+    if not g.user:
+        return jsonify({"status": "failure", "message": "User not authenticated"}), 401
+    body = request.get_json(silent=True) or {}
+    items = body.get('flights')
+    if not isinstance(items, list) or not 0 < len(items) <= MAX_BATCH_SIZE:
+        return jsonify({"error": f"Expected a list of 1 to {MAX_BATCH_SIZE} flights"}), 400
+    search = services().search_store.load(body.get('search_id'))
+    if not search:
+        return jsonify({"status": "failure", "message": "Search expired, please search again"}), 404
+
+    rows, errors = {}, []
+    for index, item in enumerate(items):
+        try:
+            row = saved_flight_row(item, search)
+        except (ValueError, AttributeError) as e:
+            errors.append({"index": index, "message": str(e)})
+            continue
+        rows.setdefault(tuple(row.values()), row)  # the same flight twice in one batch
+    if errors:
+        return jsonify({"status": "failure", "errors": errors}), 400
+
+    location_departure, location_arrival = search_locations(search)
+    for row in rows.values():
+        row.update(departure_location_id=location_departure.id, arrival_location_id=location_arrival.id,
+                   user_id=g.user.id)
+    existing = saved_flight_keys(g.user.id, rows.values())
+    new_rows = [row for row in rows.values() if flight_key(row) not in existing]
+    if new_rows:
+        try:
+            db.session.execute(insert(Flight), new_rows)
+            db.session.commit()
+        except IntegrityError as e:
+            # Another request saved one of them since the lookup
+            print(f"IntegrityError: {e}")
+            db.session.rollback()
+            return jsonify({"status": "failure", "message": "Flights changed while saving, please retry"}), 409
+    return jsonify({"status": "success", "saved": len(new_rows), "skipped": len(items) - len(new_rows)})
+
+
+def saved_flight_row(flight_details, search):
+    """Flight column values for one result posted from the search page; raises ValueError when invalid."""
+    currency = str(flight_details.get('currencyValue') or 'EUR').upper()
+    if not is_currency_code(currency):
+        raise ValueError("Invalid currency")
+    # Minutes from the results page; older clients send the ISO 8601 duration
+    duration_minutes = flight_details.get('durationMinutes')
+    if duration_minutes is None:
+        duration_minutes = parse_duration(flight_details.get('durationValue'))
+    try:
+        duration_minutes = int(duration_minutes)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid duration")
+    try:
+        price_minor = parse_amount(flight_details['priceValue'], currency)
+    except (KeyError, ValueError):
+        raise ValueError("Invalid price")
+    try:
+        flight_id = int(flight_details['flight_id'])
+        num_stops = int(flight_details['numStopsValue'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Invalid flight")
+    return {
+        'flight_id': flight_id,
+        'depart_date': datetime.fromisoformat(search['depart_date']),
+        'return_date': datetime.fromisoformat(search['return_date']),
+        'passengers': int(search['passengers']),
+        'num_stops': num_stops,
+        'duration_minutes': duration_minutes,
+        'price_minor': price_minor,
+        'currency': currency,
+    }
+
+
+def search_locations(search):
+    """Departure and arrival Location of a search, created the first time they are saved."""
+    location_departure = get_location(search['departure_iatacode'])
+    location_arrival = get_location(search['arrival_iatacode'])
+
+    if not location_departure:
+        location_departure = create_location(
+            search['departure_name'], search['departure_iatacode'], search['departure_lat'], search['departure_long'])
+
+    if not location_arrival:
+        location_arrival = create_location(
+            search['arrival_name'], search['arrival_iatacode'], search['arrival_lat'], search['arrival_long'])
+    return location_departure, location_arrival
+
+
+def flight_key(row):
+    return tuple(row[column] for column in FLIGHT_NATURAL_KEY)
+
+
+def saved_flight_keys(user_id, rows):
+    """Natural keys of `rows` the user has already saved, in one query on the unique index's leading columns."""
+    flight_ids = {row['flight_id'] for row in rows}
+    query = (db.session.query(*(getattr(Flight, column) for column in FLIGHT_NATURAL_KEY))
+             .filter(Flight.user_id == user_id, Flight.flight_id.in_(flight_ids)))
+    return {tuple(key) for key in query}
+
+
+@bp.route('/locations/suggest', methods=['GET'])
+def suggest_locations():
+    """Suggest airports and cities for autocomplete, asking the API only when the local index has no match."""
+    query = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', 8, type=int), 20))
+    if len(query) < 3:
+        return jsonify({"data": []})
+    index = get_location_index()
+    matches = [entry.serialize() for entry in index.search(query, limit)]
+    key = normalize(query)
+    location_lookups = services().location_lookups
+    if not matches and location_lookups.get(key) is None:
+        results = services().fetch_locations(query)
+        if results is None:
+            # Upstream failed; let the next request for this query try again
+            return jsonify({"data": []})
+        location_lookups.set(key, True)
+        for result in results:
+            entry = LocationEntry(result['iataCode'], result['name'], result.get('address', {}).get('cityName'),
+                                  result.get('address', {}).get('countryCode'), result['geoCode']['latitude'],
+                                  result['geoCode']['longitude'], result.get('subType', 'AIRPORT'))
+            if index.add(entry):
+                save_location(entry)
+        matches = [entry.serialize() for entry in index.search(query, limit)] or results[:limit]
+    return jsonify({"data": matches})
+
+
+def get_location_index():
+    """Return the location index, loading it on first use."""
+    location_index = services().location_index
+    if not len(location_index):
+        with services().location_index_lock:
+            if not len(location_index):
+                location_index.load_csv(os.path.join(current_app.root_path, 'data', 'airports.csv'))
+                for location in Location.query.filter(Location.iatacode.isnot(None)).all():
+                    location_index.add(LocationEntry(location.iatacode, location.name, None, None,
+                                                     location.latitude, location.longitude))
+    return location_index
+
+
+def save_location(entry):
+    """Write a location found upstream back to the locations table, unless it is already there."""
+    try:
+        with db.session.begin_nested():
+            db.session.add(Location(name=entry.name, iatacode=entry.iatacode,
+                                    latitude=entry.latitude, longitude=entry.longitude))
+        safe_commit()
+    except IntegrityError:
+        pass
+
+
 def get_location(iatacode):
     location = Location.query.filter_by(iatacode=iatacode).first()
     return location
@@ -242,26 +875,116 @@ def create_location(name, iatacode, latitude, longitude):
     return location
 
 
-@app.route('/flight/<int:id>', methods=['DELETE'])
+@bp.route('/flight/<int:id>', methods=['DELETE'])
 def delete_flight(id):
-    """Delete a saved flight by its ID."""
-    flight = Flight.query.get(id)
-    if flight:
-        db.session.delete(flight)
-        safe_commit()
+    """Delete one of the user's saved flights by its ID."""
+    if not g.user:
+        return jsonify({"status": "failure", "message": "User not authenticated"}), 401
+    deleted = Flight.query.filter_by(id=id, user_id=g.user.id).delete(synchronize_session=False)
+    safe_commit()
+    if deleted:
         return jsonify({"status": "success", "message": "Flight data deleted"})
     else:
         return jsonify({"status": "failure", "message": "Flight data not found in session"})
 
+
+@bp.route('/flights/batch', methods=['DELETE'])
+def delete_flights_batch():
+    """Delete several of the user's saved flights with one statement: {"ids": [...]}; other users' ids are ignored."""
+    if not g.user:
+        return jsonify({"status": "failure", "message": "User not authenticated"}), 401
+    ids = (request.get_json(silent=True) or {}).get('ids')
+    if (not isinstance(ids, list) or not 0 < len(ids) <= MAX_BATCH_SIZE
+            or not all(isinstance(id, int) and not isinstance(id, bool) for id in ids)):
+        return jsonify({"error": f"Expected a list of 1 to {MAX_BATCH_SIZE} flight ids"}), 400
+    deleted = (Flight.query.filter(Flight.user_id == g.user.id, Flight.id.in_(ids))
+               .delete(synchronize_session=False))
+    safe_commit()
+    return jsonify({"status": "success", "deleted": deleted})
+
+
+@bp.route('/flights/export', methods=['GET'])
+def export_flights():
+    """Stream all of the user's saved flights as CSV (?format=csv, the default) or JSON lines (?format=jsonl).
+
+    Rows are read EXPORT_BATCH_SIZE at a time through a server-side cursor and
+    written out as they arrive, so the export never holds the whole list.
+    """
+    if not g.user:
+        return jsonify({"status": "failure", "message": "User not authenticated"}), 401
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'jsonl'):
+        return jsonify({"error": "format must be csv or jsonl"}), 400
+    departure = aliased(Location)
+    arrival = aliased(Location)
+    statement = (select(Flight.id, Flight.flight_id, departure.iatacode, arrival.iatacode, Flight.depart_date,
+                        Flight.return_date, Flight.passengers, Flight.num_stops, Flight.duration_minutes,
+                        Flight.price_minor, Flight.currency, Flight.current_price_minor, Flight.price_checked_at)
+                 .join(departure, Flight.departure_location_id == departure.id)
+                 .join(arrival, Flight.arrival_location_id == arrival.id)
+                 .where(Flight.user_id == g.user.id)
+                 .order_by(Flight.id)
+                 .execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+    def records():
+        for partition in db.session.execute(statement).partitions():
+            yield [export_record(row) for row in partition]
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        for batch in records():
+            writer.writerows([record[column] for column in EXPORT_COLUMNS] for record in batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    def generate_jsonl():
+        for batch in records():
+            yield ''.join(json.dumps(record) + '\n' for record in batch)
+
+    generate, mimetype = ((generate_csv, 'text/csv') if export_format == 'csv'
+                          else (generate_jsonl, 'application/x-ndjson'))
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=saved-flights.{export_format}',
+        'Cache-Control': 'no-store',
+    })
+
+
+def export_record(row):
+    (id, flight_id, origin, destination, depart_date, return_date, passengers, num_stops, duration_minutes,
+     price_minor, currency, current_price_minor, price_checked_at) = row
+    return {
+        'id': id,
+        'flight_id': flight_id,
+        'origin': origin,
+        'destination': destination,
+        'depart_date': depart_date.isoformat(),
+        'return_date': return_date.isoformat(),
+        'passengers': passengers,
+        'num_stops': num_stops,
+        'duration_minutes': duration_minutes,
+        'price': str(from_minor(price_minor, currency)),
+        'currency': currency,
+        'current_price': str(from_minor(current_price_minor, currency)) if current_price_minor is not None else None,
+        'price_checked_at': price_checked_at.isoformat() if price_checked_at else None,
+    }
+
 ######################################################################################################################
 # User signup/login/logout
 
 
-@app.before_request
+@bp.before_app_request
 def request_context_setup():
     """Handle page authorization."""
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        if request.endpoint in USERLESS_ENDPOINTS:
+            g.user = None
+            services().identity_cache.skip()
+        else:
+            g.user = services().identity_cache.get(session[CURR_USER_KEY])
 
         NOT_ALLOWED_PATHS_AUTHED = ['/login', '/signup']
         if request.path in NOT_ALLOWED_PATHS_AUTHED:
@@ -276,7 +999,7 @@ def request_context_setup():
             return redirect("/")
 
 
-@app.route('/signup', methods=["GET", "POST"])
+@bp.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup."""
     form = UserForm()
@@ -287,26 +1010,47 @@ def signup():
         if User.query.filter_by(email=form.email.data).first():
             flash("Email already taken", 'danger')
             return render_template('users/signup.html', form=form)
-        user = User.signup(
-            username=form.username.data,
-            password=form.password.data,
-            email=form.email.data,
-        )
+        try:
+            user = User.signup(
+                username=form.username.data,
+                password=form.password.data,
+                email=form.email.data,
+            )
+        except HashingBusy as e:
+            print(f"Signup failed: {e}")
+            flash("The server is busy. Please try again.", 'danger')
+            return render_template('users/signup.html', form=form), 503
         safe_commit()
         do_login(user)
         return redirect("/")
     return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@bp.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login."""
     form = LoginForm()
     if form.is_submitted() and form.validate():
-        user = User.authenticate(form.username.data, form.password.data)
+        username = form.username.data
+        login_throttle = services().login_throttle
+        if not login_throttle.allowed(username):
+            flash("Too many failed attempts. Please try again later.", 'danger')
+            return render_template('users/login.html', form=form), 429
+        try:
+            user = User.authenticate(username, form.password.data)
+            if user and hasher.needs_rehash(user.password):
+                # Work factor changed since this password was hashed
+                user.password = hasher.hash(form.password.data)
+                safe_commit()
+        except HashingBusy as e:
+            print(f"Login failed: {e}")
+            flash("The server is busy. Please try again.", 'danger')
+            return render_template('users/login.html', form=form), 503
         if user:
+            login_throttle.succeeded(username)
             do_login(user)
             return redirect("/")
+        login_throttle.failed(username)
         flash("Invalid credentials.", 'danger')
     return render_template('users/login.html', form=form)
 
@@ -316,7 +1060,7 @@ def do_login(user):
     flash(f'Hello, {user.username}.', 'welcome-msg')
 
 
-@app.route('/logout', methods=["GET"])
+@bp.route('/logout', methods=["GET"])
 def logout():
     """Handle user logout."""
     if CURR_USER_KEY in session:
@@ -328,7 +1072,7 @@ def logout():
 # General user routes
 
 
-@app.route('/users/<int:user_id>')
+@bp.route('/users/<int:user_id>')
 def users_show(user_id):
     """Display user profile."""
     if not g.user or g.user.id != user_id:
@@ -338,11 +1082,15 @@ def users_show(user_id):
     return render_template('users/detail.html', user=user)
 
 
-@app.route('/users/profile', methods=["GET", "POST"])
+@bp.route('/users/profile', methods=["GET", "POST"])
 def profile():
     """Handle profile update."""
     form = UserForm()
     if form.is_submitted() and form.validate():
+        if form.username.data == g.user.username and form.email.data == g.user.email:
+            # Nothing changes, so there is no need to spend a password check on it
+            flash('Profile updated successfully', 'success')
+            return redirect('/users/profile')
         if form.username.data != g.user.username:
             if User.query.filter(User.username == form.username.data).first():
                 flash("Username already taken", 'danger')
@@ -351,31 +1099,154 @@ def profile():
             if User.query.filter(User.email == form.email.data).first():
                 flash("Email already taken", 'danger')
                 return redirect('/users/profile')
-        user = User.authenticate(g.user.username, form.password.data)
+        login_throttle = services().login_throttle
+        if not login_throttle.allowed(g.user.username):
+            flash("Too many failed attempts. Please try again later.", 'danger')
+            return redirect('/users/profile')
+        try:
+            user = User.authenticate(g.user.username, form.password.data)
+        except HashingBusy as e:
+            print(f"Profile update failed: {e}")
+            flash("The server is busy. Please try again.", 'danger')
+            return redirect('/users/profile')
         if user:
-            g.user.username = form.username.data
-            g.user.email = form.email.data
+            login_throttle.succeeded(g.user.username)
+            user.username = form.username.data
+            user.email = form.email.data
             safe_commit()
+            services().identity_cache.invalidate(user.id)
             flash(f'Profile updated successfully', 'success')
             return redirect('/users/profile')
 
         else:
+            login_throttle.failed(g.user.username)
             flash(f'Invalid password', 'danger')
     return render_template('users/edit.html', form=form)
 
 
-@app.route('/users/delete', methods=["POST"])
+@bp.route('/users/delete', methods=["POST"])
 def delete_user():
     """Delete user account."""
     if g.user:
         session.pop(CURR_USER_KEY)
-        db.session.delete(g.user)
+        db.session.delete(User.query.get(g.user.id))
         safe_commit()
+        services().identity_cache.invalidate(g.user.id)
         flash(f'User deleted successfully.', 'goodbye-msg')
         return redirect('/')
     else:
         return jsonify({"error": "User not found"}), 404
 
 
+######################################################################################################################
+# Instrumentation
+
+
+@bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Request, database, upstream, template and cache metrics of this worker, in Prometheus text format."""
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+######################################################################################################################
+# Database maintenance commands
+
+
+@bp.cli.command('db-upgrade')
+def db_upgrade():
+    """Create missing tables and apply pending schema migrations."""
+    import migrations
+
+    if not inspect(db.engine).has_table('flights'):
+        # A new database gets the current schema straight from the models
+        db.create_all()
+        migrations.stamp(db)
+        print("Database created.")
+        return
+    db.create_all()
+    applied = migrations.upgrade(db)
+    print(f"Applied migrations: {applied}" if applied else "Database is up to date.")
+
+
+@bp.cli.command('seed')
+@click.confirmation_option(prompt='This drops every table and loads the sample data. Continue?')
+def seed():
+    """Recreate the tables with sample locations, a demo user and two saved flights."""
+    from seed import seed_database
+
+    seed_database()
+    print("Database seeded.")
+
+
+@bp.cli.command('explain-queries')
+def explain_queries():
+    """Print the query plan of each hot query."""
+    import migrations
+
+    hot_queries = {
+        'saved flights page': saved_flights_query(1),
+        'saved flights by price': saved_flights_query(1, sort='price'),
+        'saved flights by duration': saved_flights_query(1, sort='duration'),
+        'duplicate flight check': Flight.query.filter_by(
+            user_id=1, flight_id=1, departure_location_id=1, arrival_location_id=2,
+            depart_date=datetime(2030, 1, 1), return_date=datetime(2030, 1, 5), passengers=1,
+            num_stops=0, duration_minutes=60, price_minor=10000, currency='EUR'),
+        'location by iatacode': Location.query.filter_by(iatacode='SEA'),
+        'user by username': User.query.filter_by(username='aaa'),
+    }
+    for name, query in hot_queries.items():
+        print(f"== {name}")
+        for line in migrations.explain(db, query):
+            print(f"   {line}")
+
+
+@bp.cli.command('price-watch')
+@click.option('--once', is_flag=True, help='Re-price one batch and exit.')
+@click.option('--batch-size', type=int, help='Trips re-priced per batch (default PRICE_WATCH_BATCH).')
+@click.option('--interval', type=float, help='Seconds to sleep when no full batch is due (default PRICE_WATCH_INTERVAL).')
+def price_watch(once, batch_size, interval):
+    """Re-price saved flights in the background; run as its own process, next to the web workers."""
+    from price_watch import PriceWatcher
+
+    config = current_app.config
+    watcher = PriceWatcher(
+        services().search_flights,
+        services().cached_flights,
+        RateLimiter(rate=config['PRICE_WATCH_RATE'], burst=1),
+        batch_size=batch_size or config['PRICE_WATCH_BATCH'],
+        stale_after=timedelta(hours=config['PRICE_WATCH_STALE_HOURS']))
+    if once:
+        watcher.run_once()
+        print(f"Price watch: {watcher.stats()}")
+    else:
+        watcher.run_forever(interval or config['PRICE_WATCH_INTERVAL'])
+
+
+######################################################################################################################
+# Application factory
+
+
+def create_app(config=None):
+    """Create the app; `config` is a config class or name from config.py, defaulting to the environment's.
+
+    Nothing here touches the database or the upstream APIs, so a worker boots in
+    the time it takes to import the modules. Create the tables with
+    `flask db-upgrade` and load sample data with `flask seed`.
+    """
+    app = Flask(__name__)
+    app.config.from_object(get_config(config) if config is None or isinstance(config, str) else config)
+    init_db(app, db)
+    hasher.init_app(app)
+    metrics.init_app(app)
+    static_assets.init_app(app)
+    compressor.init_app(app)
+    init_services(app)
+    app.register_blueprint(bp)
+    return app
+
+
 if __name__ == '__main__':
-    app.run(debug=os.getenv('FLASK_ENV') == 'development')
+    create_app().run(debug=os.getenv('FLASK_ENV') == 'development')
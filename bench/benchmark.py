@@ -0,0 +1,490 @@
+"""Benchmarks for FlightCast.
+
+`load` starts the stub upstream server and the app under gunicorn, drives a
+mix of search/save/list/delete traffic from concurrent virtual users, and
+reports requests/sec, p50/p95/p99 latency and DB queries per route:
+
+    python bench/benchmark.py load --workers 1,4 --concurrency 8 --duration 20
+    python bench/benchmark.py load --app-url http://127.0.0.1:5000   # already running app
+
+Without --database-url a throwaway SQLite file is used; pass a Postgres URL to
+measure against the production database engine.
+
+`dedup` compares decoding a large flight-offers payload with json.loads and the
+old per-flight-number filter against the streaming dedup in offers.py, keeping
+either plain dicts or the slotted Offer records. It reports time, peak memory
+per request, memory the result holds while it is cached in a worker, and its
+pickled size (what the cache budgets and the sqlite cache stores):
+
+    python bench/benchmark.py dedup --offers 5000
+
+`startup` times importing the app and calling create_app() in fresh
+interpreters, and how long gunicorn takes from launch to serving a request:
+
+    python bench/benchmark.py startup --runs 5 --workers 4
+
+`login` measures login throughput under gunicorn for each hashing pool size
+(0 hashes inline on the request thread), optionally mixing in wrong-password
+attempts against one account to exercise the login throttle:
+
+    python bench/benchmark.py login --pool-sizes 0,2 --rounds 12 --wrong-password-rate 0.5
+"""
+import argparse
+import copy
+import io
+import json
+import os
+import pickle
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+ROUTES = [
+    # (departure name, iatacode, lat, long), (arrival ...)
+    (('SEATTLE-TACOMA INTL', 'SEA', 47.4499, -122.3118), ('LOS ANGELES INTERNATIONAL', 'LAX', 33.9425, -118.4081)),
+    (('SAN FRANCISCO INTL', 'SFO', 37.6189, -122.3750), ('JOHN F KENNEDY INTL', 'JFK', 40.6398, -73.7789)),
+    (('SEATTLE-TACOMA INTL', 'SEA', 47.4499, -122.3118), ('CANCUN INTL', 'CUN', 21.0365, -86.8771)),
+    (('CHICAGO OHARE INTL', 'ORD', 41.9786, -87.9048), ('MIAMI INTL', 'MIA', 25.7932, -80.2906)),
+]
+
+DEFAULT_MIX = 'search=35,list=25,list_json=15,save=15,delete=10'
+
+CSRF_RE = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, int(round(pct / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+class Results:
+    """Latency samples, errors and DB query counts per route."""
+
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, route, elapsed, response):
+        ok = response is not None and response.status_code < 400
+        queries = response.headers.get('X-DB-Queries') if response is not None else None
+        with self.lock:
+            sample = self.samples.setdefault(route, {'latency': [], 'errors': 0, 'queries': []})
+            sample['latency'].append(elapsed)
+            if not ok:
+                sample['errors'] += 1
+            if queries is not None:
+                sample['queries'].append(int(queries))
+
+    def summary(self, wall_time):
+        rows = {}
+        for route, sample in sorted(self.samples.items()):
+            latency = sample['latency']
+            rows[route] = {
+                'requests': len(latency),
+                'errors': sample['errors'],
+                'rps': len(latency) / wall_time,
+                'p50_ms': percentile(latency, 50) * 1000,
+                'p95_ms': percentile(latency, 95) * 1000,
+                'p99_ms': percentile(latency, 99) * 1000,
+                'db_queries': (sum(sample['queries']) / len(sample['queries'])) if sample['queries'] else None,
+            }
+        total = sum(row['requests'] for row in rows.values())
+        return {'wall_time_s': wall_time, 'requests': total, 'rps': total / wall_time, 'routes': rows}
+
+
+class VirtualUser:
+    """One browser session signing up, searching, saving, listing and deleting flights."""
+
+    def __init__(self, base_url, name, results):
+        self.base_url = base_url
+        self.name = name
+        self.results = results
+        self.http = requests.Session()
+        self.csrf_token = None
+
+    def call(self, route, method, path, **kwargs):
+        start = time.perf_counter()
+        response = None
+        try:
+            response = self.http.request(method, self.base_url + path, timeout=60, **kwargs)
+            return response
+        except requests.RequestException:
+            return None
+        finally:
+            if route:
+                self.results.record(route, time.perf_counter() - start, response)
+
+    def refresh_csrf(self, path='/'):
+        response = self.call(None, 'GET', path)
+        match = CSRF_RE.search(response.text) if response is not None else None
+        self.csrf_token = match.group(1) if match else None
+
+    def signup(self):
+        self.refresh_csrf('/signup')
+        self.call(None, 'POST', '/signup', data={
+            'csrf_token': self.csrf_token, 'username': self.name,
+            'password': 'benchpassword', 'email': f'{self.name}@example.com'})
+        self.refresh_csrf()
+
+    def login(self, password='benchpassword', route='login'):
+        """Log in from a fresh browser session."""
+        self.http.cookies.clear()
+        self.refresh_csrf('/login')
+        return self.call(route, 'POST', '/login', allow_redirects=False, data={
+            'csrf_token': self.csrf_token, 'username': self.name, 'password': password})
+
+    def search(self):
+        (dep_name, dep_code, dep_lat, dep_long), (arr_name, arr_code, arr_lat, arr_long) = random.choice(ROUTES)
+        depart = date.today() + timedelta(days=random.randint(20, 60))
+        self.call('search', 'POST', '/submit', data={
+            'csrf_token': self.csrf_token,
+            'departure_location': dep_name.split()[0], 'arrival_location': arr_name.split()[0],
+            'departure_name': dep_name, 'departure_iatacode': dep_code,
+            'departure_lat': dep_lat, 'departure_long': dep_long,
+            'arrival_name': arr_name, 'arrival_iatacode': arr_code,
+            'arrival_lat': arr_lat, 'arrival_long': arr_long,
+            'depart_date': depart.isoformat(),
+            'return_date': (depart + timedelta(days=random.randint(2, 10))).isoformat(),
+            'passengers': str(random.randint(1, 3))})
+
+    def save(self):
+        self.call('save', 'POST', '/save_flight', json={
+            'flight_id': str(random.randint(1, 25)), 'numStopsValue': str(random.randint(0, 1)),
+            'durationValue': f'PT{random.randint(2, 9)}H{random.randint(0, 59)}M',
+            'priceValue': f'{random.uniform(120, 900):.2f}'})
+
+    def list(self):
+        self.call('list', 'GET', '/')
+
+    def list_json(self):
+        return self.call('list_json', 'GET', '/flights')
+
+    def delete(self):
+        response = self.list_json()
+        flights = response.json().get('flights', []) if response is not None and response.ok else []
+        if flights:
+            self.call('delete', 'DELETE', f"/flight/{random.choice(flights)['id']}")
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        name, weight = part.split('=')
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def drive(base_url, concurrency, duration, mix, label):
+    """Run the traffic mix against `base_url` for `duration` seconds and return the summary."""
+    results = Results()
+    users = [VirtualUser(base_url, f'bench{label}u{i}{random.randint(0, 10**6)}', results) for i in range(concurrency)]
+    for user in users:
+        user.signup()
+        user.search()
+        user.save()
+    results.samples.clear()
+
+    names, weights = zip(*parse_mix(mix).items())
+    deadline = time.monotonic() + duration
+
+    def run(user):
+        while time.monotonic() < deadline:
+            getattr(user, random.choices(names, weights)[0])()
+
+    threads = [threading.Thread(target=run, args=(user,)) for user in users]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results.summary(time.monotonic() - start)
+
+
+def wait_until_up(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=2).status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f'{url} did not come up within {timeout}s')
+
+
+def start_stub(args):
+    stub = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'stub_server.py'),
+                             '--port', str(args.stub_port), '--latency', str(args.stub_latency),
+                             '--jitter', str(args.stub_jitter), '--error-rate', str(args.stub_error_rate)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_until_up(f'http://127.0.0.1:{args.stub_port}/v4/latest/EUR')
+    return stub
+
+
+def start_app(args, workers, database_url, **settings):
+    stub_url = f'http://127.0.0.1:{args.stub_port}'
+    env = dict(os.environ,
+               DATABASE_URL=database_url,
+               SECRET_KEY=os.getenv('SECRET_KEY', 'bench-secret'),
+               AMADEUS_BASE_URL=stub_url, WEATHER_BASE_URL=stub_url, EXCHANGE_RATE_BASE_URL=stub_url,
+               **{name: str(value) for name, value in settings.items()})
+    subprocess.run(['flask', '--app', 'app', 'db-upgrade'], cwd=ROOT_DIR, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    app = subprocess.Popen(['gunicorn', '--workers', str(workers), '--preload',
+                            '--config', os.path.join(BENCH_DIR, 'gunicorn_conf.py'),
+                            '--bind', f'127.0.0.1:{args.port}', 'app:create_app()'],
+                           cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_until_up(f'http://127.0.0.1:{args.port}/login')
+    return app
+
+
+def print_summary(title, summary):
+    print(f'\n{title}: {summary["requests"]} requests in {summary["wall_time_s"]:.1f}s, '
+          f'{summary["rps"]:.1f} req/s')
+    print(f'{"route":<12}{"reqs":>8}{"errors":>8}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"queries":>9}')
+    for route, row in summary['routes'].items():
+        queries = f'{row["db_queries"]:.1f}' if row['db_queries'] is not None else '-'
+        print(f'{route:<12}{row["requests"]:>8}{row["errors"]:>8}{row["rps"]:>9.1f}{row["p50_ms"]:>9.1f}'
+              f'{row["p95_ms"]:>9.1f}{row["p99_ms"]:>9.1f}{queries:>9}')
+
+
+def load(args):
+    report = {}
+    if args.app_url:
+        summary = drive(args.app_url.rstrip('/'), args.concurrency, args.duration, args.mix, 'ext')
+        print_summary(args.app_url, summary)
+        report[args.app_url] = summary
+    else:
+        stub = start_stub(args)
+        try:
+            for workers in (int(w) for w in args.workers.split(',')):
+                with tempfile.TemporaryDirectory() as tmp:
+                    database_url = args.database_url or f'sqlite:///{os.path.join(tmp, "bench.db")}'
+                    app = start_app(args, workers, database_url)
+                    try:
+                        summary = drive(f'http://127.0.0.1:{args.port}', args.concurrency, args.duration,
+                                        args.mix, f'w{workers}')
+                    finally:
+                        app.terminate()
+                        app.wait()
+                title = f'gunicorn --workers {workers}'
+                print_summary(title, summary)
+                report[title] = summary
+        finally:
+            stub.terminate()
+            stub.wait()
+    return report
+
+
+def drive_logins(base_url, concurrency, duration, wrong_password_rate, label):
+    """Log `concurrency` users in over and over; a share of attempts use a wrong password for another account."""
+    results = Results()
+    users = [VirtualUser(base_url, f'bench{label}u{i}{random.randint(0, 10**6)}', results) for i in range(concurrency)]
+    for user in users:
+        user.signup()
+    victim = VirtualUser(base_url, f'bench{label}victim{random.randint(0, 10**6)}', results)
+    victim.signup()
+    deadline = time.monotonic() + duration
+
+    def run(user):
+        attacker = VirtualUser(base_url, victim.name, results)
+        while time.monotonic() < deadline:
+            if random.random() < wrong_password_rate:
+                attacker.login('wrongpassword', route='login_wrong')
+            else:
+                user.login()
+
+    threads = [threading.Thread(target=run, args=(user,)) for user in users]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results.summary(time.monotonic() - start)
+
+
+def login(args):
+    report = {}
+    for pool_size in (int(size) for size in args.pool_sizes.split(',')):
+        with tempfile.TemporaryDirectory() as tmp:
+            database_url = args.database_url or f'sqlite:///{os.path.join(tmp, "bench.db")}'
+            app = start_app(args, args.workers, database_url,
+                            BCRYPT_LOG_ROUNDS=args.rounds, HASH_POOL_SIZE=pool_size)
+            try:
+                summary = drive_logins(f'http://127.0.0.1:{args.port}', args.concurrency, args.duration,
+                                       args.wrong_password_rate, f'p{pool_size}')
+            finally:
+                app.terminate()
+                app.wait()
+        title = f'HASH_POOL_SIZE={pool_size}, {args.workers} workers, rounds {args.rounds}'
+        print_summary(title, summary)
+        report[title] = summary
+    return report
+
+
+STARTUP_SNIPPET = ('import time; start = time.perf_counter(); from app import create_app; create_app(); '
+                   'print(time.perf_counter() - start)')
+
+
+def startup(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = args.database_url or f'sqlite:///{os.path.join(tmp, "bench.db")}'
+        env = dict(os.environ, DATABASE_URL=database_url, SECRET_KEY=os.getenv('SECRET_KEY', 'bench-secret'))
+        create_times = []
+        for _ in range(args.runs):
+            output = subprocess.run([sys.executable, '-c', STARTUP_SNIPPET], cwd=ROOT_DIR, env=env, check=True,
+                                    capture_output=True, text=True).stdout
+            create_times.append(float(output.strip().splitlines()[-1]))
+        boot_times = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            app = start_app(args, args.workers, database_url)
+            boot_times.append(time.perf_counter() - start)
+            app.terminate()
+            app.wait()
+    report = {
+        'create_app_ms': {'p50': percentile(create_times, 50) * 1000, 'max': max(create_times) * 1000},
+        'gunicorn_boot_ms': {'p50': percentile(boot_times, 50) * 1000, 'max': max(boot_times) * 1000},
+    }
+    print(f'\nimport + create_app(): p50 {report["create_app_ms"]["p50"]:.0f} ms, '
+          f'max {report["create_app_ms"]["max"]:.0f} ms over {args.runs} runs')
+    print(f'gunicorn --workers {args.workers} launch to first response (includes flask db-upgrade): '
+          f'p50 {report["gunicorn_boot_ms"]["p50"]:.0f} ms, max {report["gunicorn_boot_ms"]["max"]:.0f} ms')
+    return report
+
+
+def legacy_filter_flights(flights, iatacode):
+    """The filter search_flights() used before offers.py, kept as the dedup baseline."""
+    seen = set()
+    filter_flights = []
+    for flight in flights['data']:
+        flight_number = flight['itineraries'][0]['segments'][0]['number']
+        departure_iatacode = flight['itineraries'][0]['segments'][0]['departure']['iataCode']
+        if flight_number not in seen and departure_iatacode == iatacode:
+            filter_flights.append(flight)
+            seen.add(flight_number)
+    return {"data": filter_flights}
+
+
+def synthetic_offers(count):
+    """Build a flight-offers payload of `count` offers from the fixture, a third of them duplicates."""
+    with open(os.path.join(BENCH_DIR, 'fixtures', 'flight_offers.json')) as f:
+        fixture = json.load(f)
+    offers = []
+    for i in range(count):
+        offer = copy.deepcopy(fixture['data'][i % len(fixture['data'])])
+        offer['id'] = str(i + 1)
+        if i % 3:
+            # Distinct flight numbers, except every third offer repeats an earlier itinerary
+            for itinerary in offer['itineraries']:
+                for segment in itinerary['segments']:
+                    segment['number'] = str(1000 + i)
+        offer['price']['total'] = f'{100 + (i * 37) % 900:.2f}'
+        offers.append(offer)
+    return json.dumps(dict(fixture, data=offers)).encode()
+
+
+def measure(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    result = fn()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'best_ms': min(times) * 1000, 'peak_kb': peak / 1024, 'retained_kb': retained / 1024,
+            'pickled_kb': len(pickle.dumps(result, pickle.HIGHEST_PROTOCOL)) / 1024, 'offers': len(result)}
+
+
+def dedup(args):
+    from offers import dedupe_offers
+
+    body = synthetic_offers(args.offers)
+    origin = json.loads(body)['data'][0]['itineraries'][0]['segments'][0]['departure']['iataCode']
+    report = {
+        'payload_kb': len(body) / 1024,
+        'legacy': measure(lambda: legacy_filter_flights(json.loads(body), origin)['data'], args.repeat),
+        'dicts': measure(lambda: [offer.serialize() for offer in dedupe_offers(io.BytesIO(body), origin)],
+                         args.repeat),
+        'slotted': measure(lambda: tuple(dedupe_offers(io.BytesIO(body), origin)), args.repeat),
+    }
+    print(f'\n{args.offers} offers, {report["payload_kb"]:.0f} KB payload')
+    print(f'{"pipeline":<12}{"best ms":>10}{"peak KB":>10}{"held KB":>10}{"pickled KB":>12}{"offers":>8}')
+    for name in ('legacy', 'dicts', 'slotted'):
+        row = report[name]
+        print(f'{name:<12}{row["best_ms"]:>10.1f}{row["peak_kb"]:>10.0f}{row["retained_kb"]:>10.0f}'
+              f'{row["pickled_kb"]:>12.0f}{row["offers"]:>8}')
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--json', help='also write the report to this file')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    load_parser = commands.add_parser('load', help='load test the app against the stub upstreams')
+    load_parser.add_argument('--workers', default='1,4', help='comma separated gunicorn worker counts to run')
+    load_parser.add_argument('--concurrency', type=int, default=8, help='number of virtual users')
+    load_parser.add_argument('--duration', type=float, default=20, help='seconds of traffic per run')
+    load_parser.add_argument('--mix', default=DEFAULT_MIX, help='route weights, e.g. ' + DEFAULT_MIX)
+    load_parser.add_argument('--port', type=int, default=8090)
+    load_parser.add_argument('--database-url', help='defaults to a temporary SQLite database')
+    load_parser.add_argument('--app-url', help='benchmark an already running app instead of starting gunicorn')
+    load_parser.add_argument('--stub-port', type=int, default=8081)
+    load_parser.add_argument('--stub-latency', type=float, default=0.1)
+    load_parser.add_argument('--stub-jitter', type=float, default=0.05)
+    load_parser.add_argument('--stub-error-rate', type=float, default=0.0)
+    load_parser.set_defaults(run=load)
+
+    startup_parser = commands.add_parser('startup', help='measure app creation and gunicorn boot time')
+    startup_parser.add_argument('--runs', type=int, default=5)
+    startup_parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    startup_parser.add_argument('--port', type=int, default=8090)
+    startup_parser.add_argument('--stub-port', type=int, default=8081)
+    startup_parser.add_argument('--database-url', help='defaults to a temporary SQLite database')
+    startup_parser.set_defaults(run=startup)
+
+    login_parser = commands.add_parser('login', help='measure login throughput per hashing pool size')
+    login_parser.add_argument('--pool-sizes', default='0,2', help='comma separated HASH_POOL_SIZE values to run')
+    login_parser.add_argument('--rounds', type=int, default=12, help='BCRYPT_LOG_ROUNDS')
+    login_parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    login_parser.add_argument('--concurrency', type=int, default=8, help='number of users logging in at once')
+    login_parser.add_argument('--duration', type=float, default=15, help='seconds of traffic per run')
+    login_parser.add_argument('--wrong-password-rate', type=float, default=0.0,
+                              help='share of attempts using a wrong password for one account')
+    login_parser.add_argument('--port', type=int, default=8090)
+    login_parser.add_argument('--stub-port', type=int, default=8081)
+    login_parser.add_argument('--database-url', help='defaults to a temporary SQLite database')
+    login_parser.set_defaults(run=login)
+
+    dedup_parser = commands.add_parser('dedup', help='compare the legacy flight filter with the streaming dedup')
+    dedup_parser.add_argument('--offers', type=int, default=5000, help='offers in the synthetic payload')
+    dedup_parser.add_argument('--repeat', type=int, default=5)
+    dedup_parser.set_defaults(run=dedup)
+
+    args = parser.parse_args()
+    report = args.run(args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
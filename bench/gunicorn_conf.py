@@ -0,0 +1,34 @@
+"""Gunicorn config used by bench/benchmark.py.
+
+Counts the SQL statements each request executes and reports them in an
+X-DB-Queries response header, so the benchmark can show queries per route.
+"""
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_local = threading.local()
+
+
+def _count_query(*args):
+    _local.count = getattr(_local, 'count', 0) + 1
+
+
+class QueryCountMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        _local.count = 0
+
+        def counting_start_response(status, headers, exc_info=None):
+            headers.append(('X-DB-Queries', str(_local.count)))
+            return start_response(status, headers, exc_info)
+
+        return self.app(environ, counting_start_response)
+
+
+def post_worker_init(worker):
+    event.listen(Engine, 'before_cursor_execute', _count_query)
+    worker.wsgi = QueryCountMiddleware(worker.wsgi)
@@ -0,0 +1,164 @@
+"""Local stand-in for the Amadeus, Visual Crossing and exchange rate APIs.
+
+Replays the recorded responses in bench/fixtures so the app can be exercised
+without touching the rate-limited live APIs. Latency and errors can be
+injected to see how the app behaves when an upstream is slow or failing.
+
+    python bench/stub_server.py --port 8081 --latency 0.15 --jitter 0.05 --error-rate 0.02
+
+Then point the app at it:
+
+    AMADEUS_BASE_URL=http://127.0.0.1:8081 WEATHER_BASE_URL=http://127.0.0.1:8081 \\
+    EXCHANGE_RATE_BASE_URL=http://127.0.0.1:8081 flask run
+
+With --record, requests are forwarded to the real APIs and the responses are
+saved over the fixtures instead, to refresh the recordings.
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import time
+from datetime import date, timedelta
+
+import requests
+from flask import Flask, jsonify, request
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+REAL_BASE_URLS = {
+    'token': 'https://test.api.amadeus.com',
+    'flight_offers': 'https://test.api.amadeus.com',
+    'locations': 'https://test.api.amadeus.com',
+    'weather_timeline': 'https://weather.visualcrossing.com',
+    'exchange_rate': 'https://api.exchangerate-api.com',
+}
+
+stub = Flask(__name__)
+stub.config.update(LATENCY=0.0, JITTER=0.0, ERROR_RATE=0.0, ERROR_STATUS=503, RECORD=False,
+                   FIXTURES_DIR=FIXTURES_DIR)
+_fixtures = {}
+
+
+def load_fixture(name):
+    if name not in _fixtures:
+        with open(os.path.join(stub.config['FIXTURES_DIR'], f'{name}.json')) as f:
+            _fixtures[name] = json.load(f)
+    return _fixtures[name]
+
+
+def record(name):
+    """Forward the current request to the real API and save the response as the fixture."""
+    url = REAL_BASE_URLS[name] + request.full_path.rstrip('?')
+    response = requests.request(request.method, url, data=request.form or None,
+                                headers={k: v for k, v in request.headers if k in ('Authorization', 'Content-Type')},
+                                timeout=30)
+    if response.status_code == 200:
+        _fixtures[name] = response.json()
+        with open(os.path.join(stub.config['FIXTURES_DIR'], f'{name}.json'), 'w') as f:
+            json.dump(_fixtures[name], f, indent=2)
+    return response.content, response.status_code, {'Content-Type': 'application/json'}
+
+
+@stub.before_request
+def inject_latency_and_errors():
+    if stub.config['RECORD']:
+        return None
+    delay = stub.config['LATENCY'] + random.uniform(0, stub.config['JITTER'])
+    if delay > 0:
+        time.sleep(delay)
+    if random.random() < stub.config['ERROR_RATE']:
+        return jsonify({'errors': [{'status': stub.config['ERROR_STATUS'], 'title': 'Injected error'}]}), \
+            stub.config['ERROR_STATUS']
+    return None
+
+
+@stub.route('/v1/security/oauth2/token', methods=['POST'])
+def token():
+    if stub.config['RECORD']:
+        return record('token')
+    return jsonify(load_fixture('token'))
+
+
+@stub.route('/v2/shopping/flight-offers', methods=['GET'])
+def flight_offers():
+    if stub.config['RECORD']:
+        return record('flight_offers')
+    data = copy.deepcopy(load_fixture('flight_offers'))
+    retarget(data['data'], request.args)
+    return jsonify(data)
+
+
+@stub.route('/v1/reference-data/locations', methods=['GET'])
+def locations():
+    if stub.config['RECORD']:
+        return record('locations')
+    keyword = request.args.get('keyword', '').upper()
+    data = load_fixture('locations')
+    matches = [loc for loc in data['data']
+               if keyword in loc['iataCode'] or keyword in loc['name'] or keyword in loc['address']['cityName']]
+    return jsonify({'meta': {'count': len(matches)}, 'data': matches})
+
+
+@stub.route('/VisualCrossingWebServices/rest/services/timeline/<location>/<start>/<end>', methods=['GET'])
+def weather_timeline(location, start, end):
+    if stub.config['RECORD']:
+        return record('weather_timeline')
+    data = copy.deepcopy(load_fixture('weather_timeline'))
+    recorded_days = data['days']
+    start, end = date.fromisoformat(start), date.fromisoformat(end)
+    data['days'] = []
+    for n in range((end - start).days + 1):
+        day = dict(recorded_days[n % len(recorded_days)])
+        day['datetime'] = (start + timedelta(days=n)).isoformat()
+        data['days'].append(day)
+    data['resolvedAddress'] = data['address'] = location
+    return jsonify(data)
+
+
+@stub.route('/v4/latest/<base>', methods=['GET'])
+def exchange_rate(base):
+    if stub.config['RECORD']:
+        return record('exchange_rate')
+    return jsonify(load_fixture('exchange_rate'))
+
+
+def retarget(offers, params):
+    """Rewrite recorded offers to the requested route and dates so the app's origin filter keeps them."""
+    origin = params.get('originLocationCode', '').upper()
+    destination = params.get('destinationLocationCode', '').upper()
+    dates = [params.get('departureDate'), params.get('returnDate')]
+    for offer in offers:
+        for itinerary, (frm, to), day in zip(offer['itineraries'], ((origin, destination), (destination, origin)), dates):
+            segments = itinerary['segments']
+            if frm:
+                segments[0]['departure']['iataCode'] = frm
+            if to:
+                segments[-1]['arrival']['iataCode'] = to
+            if day:
+                shift = date.fromisoformat(day) - date.fromisoformat(segments[0]['departure']['at'][:10])
+                for segment in segments:
+                    for point in (segment['departure'], segment['arrival']):
+                        moved = date.fromisoformat(point['at'][:10]) + shift
+                        point['at'] = moved.isoformat() + point['at'][10:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random latency, up to this many seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with an error')
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help='directory holding the recorded responses')
+    parser.add_argument('--record', action='store_true', help='proxy to the real APIs and save their responses')
+    args = parser.parse_args()
+    stub.config.update(LATENCY=args.latency, JITTER=args.jitter, ERROR_RATE=args.error_rate,
+                       ERROR_STATUS=args.error_status, RECORD=args.record, FIXTURES_DIR=args.fixtures)
+    stub.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
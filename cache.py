@@ -0,0 +1,213 @@
+"""TTL + LRU caches used in front of the upstream APIs.
+
+`MemoryCache` lives inside a single worker process. `SQLiteCache` keeps its
+entries in a SQLite file so every gunicorn worker on the host shares them.
+Both expose the same get/set/delete/stats interface.
+"""
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL = 300
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+# SQLiteCache records a hit for LRU eviction only when the last one is older than this, so most hits are pure reads
+TOUCH_INTERVAL = 30
+
+
+def sizeof(value):
+    """Approximate the memory held by `value` using its pickled size."""
+    return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+class CacheStats:
+    """Hit/miss counters shared by the cache backends."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def as_dict(self, entries, bytes_held):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'bytes': bytes_held,
+        }
+
+
+class MemoryCache:
+    """In-process cache with per-entry TTL and LRU eviction by entry count and bytes."""
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = CacheStats()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self._stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        size = sizeof(value)
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires_at)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return self._stats.as_dict(len(self._entries), self._bytes)
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+class SQLiteCache:
+    """Cache stored in a SQLite file, shared by all worker processes on the host.
+
+    Lookups only read; eviction order is LRU to within TOUCH_INTERVAL seconds.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES,
+                 table='cache'):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.table = table
+        self._local = threading.local()
+        self._stats = CacheStats()
+        with self._connect() as conn:
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {table} ('
+                         'key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, '
+                         'expires_at REAL NOT NULL, accessed_at REAL NOT NULL)')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_accessed_at ON {table} (accessed_at)')
+
+    def get(self, key):
+        now = time.time()
+        # A lone SELECT in autocommit mode: a read transaction that does not take the write lock
+        row = self._connect().conn.execute(
+            f'SELECT value, accessed_at FROM {self.table} WHERE key = ? AND expires_at > ?', (key, now)).fetchone()
+        if row is None:
+            self._stats.misses += 1
+            return None
+        if now - row[1] > TOUCH_INTERVAL:
+            with self._connect() as conn:
+                conn.execute(f'UPDATE {self.table} SET accessed_at = ? WHERE key = ?', (now, key))
+        self._stats.hits += 1
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._connect() as conn:
+            conn.execute(f'INSERT OR REPLACE INTO {self.table} (key, value, size, expires_at, accessed_at) '
+                         'VALUES (?, ?, ?, ?, ?)', (key, blob, len(blob), expires_at, now))
+            conn.execute(f'DELETE FROM {self.table} WHERE expires_at <= ?', (now,))
+            self._evict(conn)
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute(f'DELETE FROM {self.table}')
+
+    def stats(self):
+        with self._connect() as conn:
+            entries, bytes_held = conn.execute(
+                f'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table} WHERE expires_at > ?',
+                (time.time(),)).fetchone()
+        return self._stats.as_dict(entries, bytes_held)
+
+    def _evict(self, conn):
+        entries, bytes_held = conn.execute(f'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}').fetchone()
+        if entries <= self.max_entries and bytes_held <= self.max_bytes:
+            return
+        rows = conn.execute(f'SELECT key, size FROM {self.table} ORDER BY accessed_at').fetchall()
+        doomed = []
+        for key, size in rows:
+            if entries <= self.max_entries and bytes_held <= self.max_bytes:
+                break
+            doomed.append((key,))
+            entries -= 1
+            bytes_held -= size
+        conn.executemany(f'DELETE FROM {self.table} WHERE key = ?', doomed)
+        self._stats.evictions += len(doomed)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Durable enough under WAL: a power loss can drop the last commits, never corrupt the file
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn = self._local.conn = _Transaction(conn)
+        return conn
+
+
+class _Transaction:
+    """Wrap a sqlite3 connection so `with` runs the block in one immediate transaction."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+def make_cache(backend='memory', path=None, **options):
+    """Build a cache from config values; `backend` is 'memory' or 'sqlite'."""
+    if backend == 'sqlite':
+        return SQLiteCache(path or 'flightcast-cache.db', **options)
+    return MemoryCache(**options)
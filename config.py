@@ -0,0 +1,130 @@
+"""Configuration objects for create_app().
+
+Every setting reads the environment variable of the same name, falling back to
+the default shown. FLASK_CONFIG picks the class (development, production or
+testing); it defaults to FLASK_ENV, and to development when neither is set.
+In development, environment.env is loaded first.
+"""
+import os
+
+from dotenv import load_dotenv
+
+if os.getenv('FLASK_ENV', 'development') == 'development':
+    load_dotenv('environment.env')
+
+
+class Config:
+    FLASK_ENV = os.getenv('FLASK_ENV', 'development')
+    SECRET_KEY = os.getenv('SECRET_KEY')
+    SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL')
+    SQLALCHEMY_ECHO = False
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+
+    # Database connections per worker: DB_POOL_SIZE kept open, up to DB_MAX_OVERFLOW more under load
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+
+    # Read replica: plain reads go here, and back to the primary for REPLICA_STICKY_SECONDS after a browser writes
+    REPLICA_DATABASE_URL = os.getenv('REPLICA_DATABASE_URL')
+    REPLICA_STICKY_SECONDS = float(os.getenv('REPLICA_STICKY_SECONDS', 5))
+
+    # Password hashing
+    BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))
+    HASH_POOL_SIZE = int(os.getenv('HASH_POOL_SIZE', 2))
+    HASH_TIMEOUT = float(os.getenv('HASH_TIMEOUT', 10))
+    LOGIN_MAX_FAILURES = int(os.getenv('LOGIN_MAX_FAILURES', 5))
+    LOGIN_THROTTLE_WINDOW = int(os.getenv('LOGIN_THROTTLE_WINDOW', 300))
+    LOGIN_THROTTLE_BACKEND = os.getenv('LOGIN_THROTTLE_BACKEND', 'memory')
+
+    # API credentials
+    CLIENT_ID = os.getenv('CLIENT_ID')
+    CLIENT_SECRET = os.getenv('CLIENT_SECRET')
+    WEATHER_TOKEN = os.getenv('WEATHER_TOKEN')
+
+    # Upstream base URLs, overridable to point at the local stub server (see bench/)
+    AMADEUS_BASE_URL = os.getenv('AMADEUS_BASE_URL', 'https://test.api.amadeus.com')
+    WEATHER_BASE_URL = os.getenv('WEATHER_BASE_URL', 'https://weather.visualcrossing.com')
+    EXCHANGE_RATE_BASE_URL = os.getenv('EXCHANGE_RATE_BASE_URL', 'https://api.exchangerate-api.com')
+
+    # Upstream HTTP client
+    UPSTREAM_POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', 10))
+    UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 3.05))
+    UPSTREAM_READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', 20))
+    UPSTREAM_RETRIES = int(os.getenv('UPSTREAM_RETRIES', 2))
+    UPSTREAM_BACKOFF = float(os.getenv('UPSTREAM_BACKOFF', 0.3))
+    AMADEUS_RATE_LIMIT = float(os.getenv('AMADEUS_RATE_LIMIT', 10))
+    AMADEUS_RATE_BURST = int(os.getenv('AMADEUS_RATE_BURST', 1))
+    AMADEUS_RATE_WAIT = float(os.getenv('AMADEUS_RATE_WAIT', 10))
+
+    # Caches
+    IDENTITY_CACHE_TTL = int(os.getenv('IDENTITY_CACHE_TTL', 30))
+    SEARCH_CACHE_BACKEND = os.getenv('SEARCH_CACHE_BACKEND', 'memory')
+    SEARCH_CACHE_PATH = os.getenv('SEARCH_CACHE_PATH')
+    SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', 300))
+    SEARCH_CACHE_MAX_ENTRIES = int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', 256))
+    SEARCH_CACHE_MAX_BYTES = int(os.getenv('SEARCH_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+    SEARCH_COALESCE_WAIT = float(os.getenv('SEARCH_COALESCE_WAIT', 30))
+    SEARCH_LOCK_DIR = os.getenv('SEARCH_LOCK_DIR')
+    SEARCH_STORE = os.getenv('SEARCH_STORE', 'cookie')
+    SEARCH_STORE_TTL = int(os.getenv('SEARCH_STORE_TTL', 2 * 60 * 60))
+    WEATHER_CACHE_TTL = int(os.getenv('WEATHER_CACHE_TTL', 3 * 60 * 60))
+    WEATHER_CACHE_MAX_ENTRIES = int(os.getenv('WEATHER_CACHE_MAX_ENTRIES', 20000))
+    WEATHER_CACHE_MAX_BYTES = int(os.getenv('WEATHER_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+
+    # Flexible-date search
+    FLEX_SEARCH_WORKERS = int(os.getenv('FLEX_SEARCH_WORKERS', 4))
+    FLEX_SEARCH_TIMEOUT = float(os.getenv('FLEX_SEARCH_TIMEOUT', 60))
+
+    # Currency: prices are shown in DISPLAY_CURRENCY, converted with rates refreshed every FX_REFRESH_INTERVAL seconds
+    DISPLAY_CURRENCY = os.getenv('DISPLAY_CURRENCY', 'USD')
+    FX_REFRESH_INTERVAL = int(os.getenv('FX_REFRESH_INTERVAL', 6 * 60 * 60))
+
+    # Responses: gzip (or brotli, when installed) text responses of at least COMPRESS_MIN_SIZE bytes
+    COMPRESS = os.getenv('COMPRESS', '1') == '1'
+    COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 500))
+
+    # Instrumentation: /metrics requires "Authorization: Bearer <METRICS_TOKEN>" when it is set
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+    SERVER_TIMING = os.getenv('SERVER_TIMING', '0') == '1'
+
+    # Price watch (flask price-watch)
+    PRICE_WATCH_RATE = float(os.getenv('PRICE_WATCH_RATE', 1))
+    PRICE_WATCH_STALE_HOURS = float(os.getenv('PRICE_WATCH_STALE_HOURS', 6))
+    PRICE_WATCH_BATCH = int(os.getenv('PRICE_WATCH_BATCH', 50))
+    PRICE_WATCH_INTERVAL = float(os.getenv('PRICE_WATCH_INTERVAL', 300))
+
+
+class DevelopmentConfig(Config):
+    """Local development; `python app.py` runs the debug server."""
+
+
+class ProductionConfig(Config):
+    """Behind gunicorn; settings come from the real environment only."""
+
+
+class TestingConfig(Config):
+    """In-memory database, no CSRF and cheap password hashing."""
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = os.getenv('TEST_DATABASE_URL', 'sqlite://')
+    BCRYPT_LOG_ROUNDS = 4
+    HASH_POOL_SIZE = 0
+
+
+CONFIGS = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'testing': TestingConfig,
+}
+
+
+def get_config(name=None):
+    """Return the config class called `name`, or the one picked by the environment."""
+    name = name or os.getenv('FLASK_CONFIG')
+    if name:
+        return CONFIGS[name]
+    return CONFIGS.get(os.getenv('FLASK_ENV', 'development'), ProductionConfig)
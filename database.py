@@ -0,0 +1,128 @@
+"""Engine and pool settings, pool checkout timing and read-replica routing.
+
+Every worker has its own pool per database: DB_POOL_SIZE connections kept
+open plus up to DB_MAX_OVERFLOW more under load, so the database has to allow
+workers x (size + overflow) connections. `TimedQueuePool` records how long
+each checkout took, including any wait for a free connection, as the
+db_pool_checkout_seconds histogram; `pool_stats()` reports the pool itself.
+
+With REPLICA_DATABASE_URL set, `RoutingSession` sends plain SELECTs to the
+replica bind and everything else to the primary. Reads of POST/PUT/DELETE
+requests and of a session that has written go to the primary too, and so do
+the reads of the browser that wrote for the next REPLICA_STICKY_SECONDS, so
+nobody misses their own change because of replication lag.
+"""
+import time
+from functools import partial
+
+from flask import g, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool
+
+from metrics import metrics
+
+REPLICA_BIND = 'replica'
+
+# Flask session key: reads go to the primary until this time
+PRIMARY_UNTIL_KEY = 'db_primary_until'
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records checkout time per bind, labelled by the engine's pool_logging_name."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkout_time = metrics.histogram('db_pool_checkout_seconds', bind=self._orig_logging_name or 'primary')
+        self.timeouts = 0
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.checkout_time.observe(time.perf_counter() - start)
+
+
+def engine_options(url, config):
+    """Engine options for `url` from the DB_POOL_* settings.
+
+    A private in-memory SQLite database keeps Flask-SQLAlchemy's single shared
+    connection, since every other connection would open an empty database.
+    """
+    options = {'pool_pre_ping': config['DB_POOL_PRE_PING'], 'pool_recycle': config['DB_POOL_RECYCLE']}
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return options
+    options.update(poolclass=TimedQueuePool, pool_size=config['DB_POOL_SIZE'],
+                   max_overflow=config['DB_MAX_OVERFLOW'], pool_timeout=config['DB_POOL_TIMEOUT'])
+    return options
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {}
+    return {
+        'size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'idle': pool.checkedin(),
+        'overflow': max(pool.overflow(), 0),
+        'timeouts': getattr(pool, 'timeouts', 0),
+    }
+
+
+class RoutingSession(Session):
+    """db.session: reads to the replica bind when there is one, writes and anything else to the primary."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self.info.get('wrote'):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                if self._is_read(clause):
+                    if not g.get('db_read_primary'):
+                        return replica
+                else:
+                    self.info['wrote'] = True
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+    def _is_read(self, clause):
+        # Flushes, DML, text() and locking reads all count as writes
+        return (not self._flushing and getattr(clause, 'is_select', False)
+                and getattr(clause, '_for_update_arg', None) is None)
+
+
+def init_db(app, db):
+    """Apply the pool and replica settings in `app.config`, register `db` on the app and export pool metrics."""
+    config = app.config
+    if config.get('SQLALCHEMY_DATABASE_URI'):
+        config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(
+            engine_options(config['SQLALCHEMY_DATABASE_URI'], config), **config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    replica_url = config.get('REPLICA_DATABASE_URL')
+    if replica_url:
+        config['SQLALCHEMY_BINDS'] = dict(config.get('SQLALCHEMY_BINDS') or {}, **{REPLICA_BIND: dict(
+            engine_options(replica_url, config), url=replica_url, pool_logging_name=REPLICA_BIND)})
+    db.init_app(app)
+
+    if replica_url:
+        sticky = config['REPLICA_STICKY_SECONDS']
+
+        @app.before_request
+        def route_reads():
+            # Requests that change data check what is there on the primary
+            g.db_read_primary = (request.method not in ('GET', 'HEAD')
+                                 or session.get(PRIMARY_UNTIL_KEY, 0) > time.time())
+
+        @app.after_request
+        def remember_writes(response):
+            if sticky and db.session.registry.has() and db.session().info.get('wrote'):
+                session[PRIMARY_UNTIL_KEY] = time.time() + sticky
+            return response
+
+    with app.app_context():
+        for name, engine in db.engines.items():
+            metrics.add_collector('db_pool', partial(pool_stats, engine), bind=name or 'primary')
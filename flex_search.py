@@ -0,0 +1,90 @@
+"""Flexible-date search: the cheapest offer for every depart/return pair within ±N days.
+
+Each cell of the date grid is an ordinary flight search, so cells already in
+the search cache are answered straight away. The rest run on a small thread
+pool shared by all flexible searches in the worker; `fetch_flights()` takes a
+token from the Amadeus rate limiter, so however many cells are in flight the
+upstream only sees the configured request rate. Cells are yielded as they
+complete so the page can fill in the price matrix progressively.
+"""
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+from datetime import date, timedelta
+
+MAX_FLEX_DAYS = 3
+
+
+def date_grid(depart_date, return_date, flex_days, today=None):
+    """Return the valid (depart, return) pairs within ±flex_days, nearest to the requested dates first."""
+    today = today or date.today()
+    offsets = range(-flex_days, flex_days + 1)
+    pairs = []
+    for depart_offset in offsets:
+        for return_offset in offsets:
+            depart = depart_date + timedelta(days=depart_offset)
+            ret = return_date + timedelta(days=return_offset)
+            if depart > today and ret > depart:
+                pairs.append((abs(depart_offset) + abs(return_offset), depart, ret))
+    pairs.sort()
+    return [(depart, ret) for _, depart, ret in pairs]
+
+
+def price_cell(depart, ret, flight_data, cached=False):
+    """Summarize one search as a price-matrix cell."""
+    cell = {'depart_date': depart.isoformat(), 'return_date': ret.isoformat(), 'cached': cached}
+    if flight_data is None:
+        cell['status'] = 'error'
+        return cell
+    offers = flight_data.get('data') or []
+    if not offers:
+        cell.update(status='empty', offers=0)
+        return cell
+    cheapest = min(offers, key=lambda offer: offer.price_minor)
+    cell.update(status='ok', offers=len(offers), price=cheapest.price, price_minor=cheapest.price_minor,
+                currency=cheapest.currency, flight_id=cheapest.id)
+    return cell
+
+
+class FlexSearch:
+    """Runs the searches of a date grid on a bounded pool and yields price cells as they complete."""
+
+    def __init__(self, search, lookup, max_workers=4, timeout=60):
+        self.search = search
+        self.lookup = lookup
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='flex-search')
+        self.cells = {'cached': 0, 'fetched': 0, 'failed': 0}
+
+    def run(self, params, flex_days):
+        """Yield a price cell for every date pair of the grid around `params`."""
+        futures = {}
+        try:
+            for depart, ret in date_grid(params['departureDate'], params['returnDate'], flex_days):
+                cell_params = dict(params, departureDate=depart, returnDate=ret)
+                flight_data = self.lookup(cell_params)
+                if flight_data is not None:
+                    self.cells['cached'] += 1
+                    yield price_cell(depart, ret, flight_data, cached=True)
+                else:
+                    futures[self.executor.submit(self.search, cell_params)] = (depart, ret)
+            try:
+                for future in as_completed(list(futures), timeout=self.timeout):
+                    depart, ret = futures.pop(future)
+                    try:
+                        flight_data = future.result()
+                    except Exception as e:
+                        print(f"Flexible search failed for {depart} - {ret}: {e}")
+                        flight_data = None
+                    self.cells['fetched' if flight_data is not None else 'failed'] += 1
+                    yield price_cell(depart, ret, flight_data)
+            except TimeoutError:
+                print(f"Flexible search timed out with {len(futures)} dates left.")
+                for depart, ret in list(futures.values()):
+                    self.cells['failed'] += 1
+                    yield price_cell(depart, ret, None)
+        finally:
+            # Client went away or the search timed out: drop work that has not started
+            for future in futures:
+                future.cancel()
+
+    def stats(self):
+        return dict(self.cells)
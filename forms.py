@@ -63,6 +63,8 @@ class FlightForm (FlaskForm):
                             is_valid_date, is_return_date_after_depart_date, InputRequired()])
     passengers = SelectField('Passengers ', validators=[
                              validate_passengers], default=1, choices=[(str(i), str(i)) for i in range(1, 10)])
+    flex_days = SelectField('Flexible dates', default='0', choices=[
+                            ('0', 'Exact dates'), ('1', '± 1 day'), ('2', '± 2 days'), ('3', '± 3 days')])
 
 
 class UserForm(FlaskForm):
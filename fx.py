@@ -0,0 +1,151 @@
+"""Currency conversion with a cached exchange rate table.
+
+Prices are stored as integer minor units (cents) with an ISO 4217 currency
+code, so they compare and add up exactly. `FxRates` keeps one table of rates
+against the base currency per worker and refreshes it every `ttl` seconds.
+Fetches always run in a background thread, so the exchange API is never on a
+request's critical path: until the first table arrives there are no rates and
+prices are shown in their own currency, later requests keep converting with
+the previous table while a new one is fetched, and a failed refresh keeps the
+old table and retries after `retry_after` seconds.
+
+`sql_to_base()` turns the same table into a CASE expression, so saved flights
+in any currency can be sorted and filtered by converted price in SQL.
+"""
+import hashlib
+import re
+import threading
+import time
+from decimal import Decimal, DecimalException, ROUND_HALF_UP
+
+from sqlalchemy import case
+
+# Currencies whose minor unit is not a hundredth
+MINOR_UNITS = {'BHD': 3, 'CLP': 0, 'ISK': 0, 'JOD': 3, 'JPY': 0, 'KRW': 0, 'KWD': 3, 'OMR': 3, 'TND': 3, 'VND': 0}
+SYMBOLS = {'USD': '$', 'EUR': '€', 'GBP': '£', 'JPY': '¥'}
+
+# Prices are stored in 32-bit integer columns
+MAX_MINOR = 2 ** 31 - 1
+
+_CURRENCY_CODE = re.compile(r'[A-Z]{3}')
+
+
+def minor_units(currency):
+    return MINOR_UNITS.get(currency, 2)
+
+
+def to_minor(amount, currency):
+    """Convert an amount in major units ('289.71', 289.71 or a Decimal) to integer minor units, rounding half up."""
+    scaled = Decimal(str(amount)).scaleb(minor_units(currency))
+    return int(scaled.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def parse_amount(amount, currency):
+    """to_minor() for amounts sent by clients; ValueError unless it is a number from 0 to MAX_MINOR minor units."""
+    try:
+        amount_minor = to_minor(amount, currency)
+    except (DecimalException, ValueError):
+        # Not a number, NaN, infinite, or too many digits for the decimal context
+        raise ValueError('not an amount')
+    if not 0 <= amount_minor <= MAX_MINOR:
+        raise ValueError('amount out of range')
+    return amount_minor
+
+
+def is_currency_code(value):
+    """Whether `value` looks like an ISO 4217 code ('EUR')."""
+    return isinstance(value, str) and _CURRENCY_CODE.fullmatch(value) is not None
+
+
+def from_minor(amount_minor, currency):
+    return Decimal(amount_minor).scaleb(-minor_units(currency))
+
+
+def format_money(amount_minor, currency):
+    """'$1,234.50 USD'; an empty string when there is no amount."""
+    if amount_minor is None:
+        return ''
+    amount = from_minor(amount_minor, currency)
+    return f'{SYMBOLS.get(currency, "")}{amount:,.{minor_units(currency)}f} {currency}'
+
+
+class FxRates:
+    """Per-worker table of exchange rates against `base`, fetched with `fetch(base)` -> {currency: rate}."""
+
+    def __init__(self, fetch, base='EUR', ttl=6 * 60 * 60, retry_after=60):
+        self.fetch = fetch
+        self.base = base
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self._rates = None
+        self._fetched_at = None
+        self._version = None
+        self._next_refresh = 0
+        self._lock = threading.Lock()
+        self.counts = {'refreshes': 0, 'failures': 0}
+
+    def rates(self):
+        """The current table, starting a background refresh when due; None until a fetch has succeeded."""
+        if time.monotonic() >= self._next_refresh and not self._lock.locked():
+            threading.Thread(target=self.refresh, name='fx-refresh', daemon=True).start()
+        return self._rates
+
+    def refresh(self):
+        with self._lock:
+            if time.monotonic() < self._next_refresh:
+                # Another thread refreshed while this one waited
+                return
+            try:
+                rates = self.fetch(self.base)
+            except Exception as e:
+                print(f"Failed to refresh exchange rates: {e}")
+                rates = None
+            if rates:
+                self._rates = dict(rates, **{self.base: 1.0})
+                self._version = hashlib.sha1(repr(sorted(self._rates.items())).encode('utf-8')).hexdigest()[:12]
+                self._fetched_at = time.monotonic()
+                self._next_refresh = self._fetched_at + self.ttl
+                self.counts['refreshes'] += 1
+            else:
+                self._next_refresh = time.monotonic() + self.retry_after
+                self.counts['failures'] += 1
+
+    def version(self):
+        """Changes whenever the table does; part of the cache key of anything showing converted prices."""
+        self.rates()
+        return self._version
+
+    def rate(self, source, target):
+        """Units of `target` per unit of `source`, or None when either is missing from the table."""
+        if source == target:
+            return 1.0
+        rates = self.rates() or {}
+        if not rates.get(source) or not rates.get(target):
+            return None
+        return rates[target] / rates[source]
+
+    def convert(self, amount_minor, source, target):
+        """Convert minor units of `source` to minor units of `target`; None when there is no rate."""
+        rate = self.rate(source, target)
+        if amount_minor is None or rate is None:
+            return None
+        return to_minor(from_minor(amount_minor, source) * Decimal(str(rate)), target)
+
+    def to_base(self, amount_minor, currency):
+        """An amount in major units of the base currency, as a float to compare with `sql_to_base()`."""
+        rate = self.rate(self.base, currency)
+        return None if rate is None else float(from_minor(amount_minor, currency)) / rate
+
+    def sql_to_base(self, amount_minor, currency):
+        """SQL expression converting the `amount_minor` column in `currency` to major units of the base currency.
+
+        Rows in a currency missing from the table convert to NULL.
+        """
+        rates = self.rates() or {self.base: 1.0}
+        # Minor units of each currency per unit of the base currency
+        divisors = {code: rate * 10 ** minor_units(code) for code, rate in rates.items() if rate}
+        return amount_minor / case(divisors, value=currency)
+
+    def stats(self):
+        age = time.monotonic() - self._fetched_at if self._fetched_at is not None else None
+        return dict(self.counts, currencies=len(self._rates or {}), age_seconds=age)
@@ -0,0 +1,149 @@
+"""Password hashing off the request thread.
+
+bcrypt is deliberately expensive: at the default work factor each hash or
+check is hundreds of milliseconds of CPU. `Hasher` runs them in a small
+process pool per worker, so the number of hashes a worker runs at once is
+bounded and a flood of logins queues (and times out) instead of piling onto
+every CPU. A pool size of 0 hashes inline. When a pool process dies (killed
+by the OOM killer, say) the pool is replaced and the hash tried once more,
+then run inline if the new pool breaks too.
+
+The work factor comes from BCRYPT_LOG_ROUNDS. Stored hashes carry their own
+factor, so `needs_rehash()` tells the login view when a password should be
+re-hashed at the current one.
+
+`LoginThrottle` counts failed password checks per username and refuses further
+attempts for a while once there are too many, before any hashing is done.
+"""
+import os
+import threading
+from concurrent.futures import TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+from flask import current_app, has_app_context
+
+from cache import MemoryCache
+
+DEFAULT_ROUNDS = 12
+
+
+class HashingBusy(Exception):
+    """The hashing pool did not get to a request within the timeout."""
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _verify(password, hashed):
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    except ValueError:
+        # Not a bcrypt hash
+        return False
+
+
+def hash_rounds(hashed):
+    """Work factor of a stored bcrypt hash ('$2b$12$...'), or None if it is not one."""
+    parts = (hashed or '').split('$')
+    return int(parts[2]) if len(parts) > 3 and parts[2].isdigit() else None
+
+
+class Hasher:
+    def __init__(self, rounds=DEFAULT_ROUNDS, pool_size=2, timeout=10):
+        self.rounds = rounds
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        # The app gets a Hasher of its own, so a second app does not change the settings or pool of the first
+        app.extensions['hasher'] = Hasher(
+            rounds=int(app.config.get('BCRYPT_LOG_ROUNDS', self.rounds)),
+            pool_size=int(app.config.get('HASH_POOL_SIZE', self.pool_size)),
+            timeout=float(app.config.get('HASH_TIMEOUT', self.timeout)))
+
+    def hash(self, password):
+        """Hash `password` at the configured work factor."""
+        hasher = self._current()
+        return hasher._run(_hash, password, hasher.rounds)
+
+    def verify(self, password, hashed):
+        return self._current()._run(_verify, password, hashed)
+
+    def needs_rehash(self, hashed):
+        return hash_rounds(hashed) != self._current().rounds
+
+    def _current(self):
+        # The current app's Hasher, or this one outside an app context
+        if has_app_context():
+            return current_app.extensions.get('hasher', self)
+        return self
+
+    def _run(self, fn, *args):
+        if not self.pool_size:
+            return fn(*args)
+        for attempt in range(2):
+            executor = self._pool()
+            try:
+                future = executor.submit(fn, *args)
+                return future.result(timeout=self.timeout)
+            except TimeoutError:
+                future.cancel()
+                raise HashingBusy(f'password hashing took longer than {self.timeout}s')
+            except BrokenProcessPool:
+                print("Password hashing pool broke, starting a new one")
+                self._discard(executor)
+        return fn(*args)
+
+    def _discard(self, executor):
+        with self._lock:
+            # Another thread may have replaced it already
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _pool(self):
+        # Created lazily, and again after a fork: gunicorn workers must not share the master's pool
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                from concurrent.futures import ProcessPoolExecutor
+
+                self._executor = ProcessPoolExecutor(max_workers=self.pool_size)
+                self._pid = os.getpid()
+            return self._executor
+
+
+class LoginThrottle:
+    """Refuse password checks for a username after `max_failures` failures within `window` seconds."""
+
+    def __init__(self, max_failures=5, window=300, cache=None):
+        self.max_failures = max_failures
+        self.cache = cache or MemoryCache(ttl=window, max_entries=100000)
+        self.refused = 0
+
+    def allowed(self, username):
+        if (self.cache.get(self._key(username)) or 0) >= self.max_failures:
+            self.refused += 1
+            return False
+        return True
+
+    def failed(self, username):
+        key = self._key(username)
+        self.cache.set(key, (self.cache.get(key) or 0) + 1)
+
+    def succeeded(self, username):
+        self.cache.delete(self._key(username))
+
+    def stats(self):
+        return {'refused': self.refused}
+
+    def _key(self, username):
+        return f'login:{(username or "").strip().lower()}'
+
+
+hasher = Hasher()
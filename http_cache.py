@@ -0,0 +1,168 @@
+"""HTTP-level caching of static assets and response compression.
+
+`StaticAssets` adds a content hash to every url_for('static', ...) URL
+(`/static/script.js?v=3f2a9c1e07b4`). Responses to a URL carrying the current
+hash are cacheable for a year and marked immutable; a changed file gets a new
+URL. Static files requested without the hash, such as the weather icons the
+script builds paths to, keep Flask's revalidation with ETag/Last-Modified.
+
+`Compressor` gzips (or, with the optional brotli package, brotli-encodes)
+text responses when the client accepts it. Static files are compressed once
+per version at the highest level and kept in memory; rendered pages at a
+cheaper level per response. Streamed responses are left alone.
+"""
+import gzip
+import hashlib
+import os
+import threading
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+COMPRESSIBLE_TYPES = {'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript', 'application/javascript',
+                      'application/json', 'image/svg+xml'}
+
+
+class StaticAssets:
+    def __init__(self):
+        self._hashes = {}  # path -> (mtime, hash)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.url_defaults(self._add_version)
+        app.after_request(self._cache_headers)
+
+    def version(self, filename):
+        """Short hash of the file's contents, or None if there is no such file."""
+        path = os.path.join(current_app.static_folder, filename)
+        cached = self._hashes.get(path)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()[:12]
+        with self._lock:
+            self._hashes[path] = (mtime, digest)
+        return digest
+
+    def _add_version(self, endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            version = self.version(values['filename'])
+            if version:
+                values['v'] = version
+
+    def _cache_headers(self, response):
+        if (request.endpoint == 'static' and response.status_code in (200, 304) and request.args.get('v')
+                and request.args['v'] == self.version(request.view_args['filename'])):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        return response
+
+
+class Compressor:
+    def __init__(self):
+        self._static = {}  # (filename, etag, encoding) -> compressed bytes
+        self._lock = threading.Lock()
+        self.counts = {'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'static_hits': 0}
+
+    def init_app(self, app):
+        app.after_request(self._compress)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def _compress(self, response):
+        if not current_app.config.get('COMPRESS', True) or response.mimetype not in COMPRESSIBLE_TYPES:
+            return response
+        response.vary.add('Accept-Encoding')
+        if (response.status_code != 200 or 'Content-Encoding' in response.headers
+                or 'Range' in request.headers):
+            return response
+        encoding = self._encoding()
+        if encoding is None:
+            return response
+
+        static = request.endpoint == 'static' and response.direct_passthrough
+        if response.is_streamed and not static:
+            # Event streams and exports are written as they are produced
+            return response
+        etag, _ = response.get_etag()
+        key = (request.view_args.get('filename'), etag, encoding) if static else None
+        compressed = self._static.get(key) if static else None
+        response.direct_passthrough = False
+        if compressed is not None:
+            if hasattr(response.response, 'close'):
+                response.response.close()
+            self._count(static_hits=1)
+        else:
+            data = response.get_data()
+            if len(data) < current_app.config.get('COMPRESS_MIN_SIZE', 500):
+                return response
+            compressed = _encode(data, encoding, best=static)
+            if static:
+                with self._lock:
+                    self._static[key] = compressed
+            self._count(bytes_in=len(data), bytes_out=len(compressed))
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        if etag:
+            # The same entity in a different encoding
+            response.set_etag(etag, weak=True)
+        self._count(responses=1)
+        return response
+
+    def _encoding(self):
+        accepted = request.accept_encodings
+        if brotli is not None and accepted['br']:
+            return 'br'
+        if accepted['gzip']:
+            return 'gzip'
+        return None
+
+    def _count(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                self.counts[name] += amount
+
+
+def _encode(data, encoding, best=False):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if best else 5)
+    return gzip.compress(data, compresslevel=9 if best else 6, mtime=0)
+
+
+def template_version(app, *names):
+    """Short hash of the source of templates `names`, so page ETags change when the templates do.
+
+    Kept for the life of the process, except when templates are reloaded on
+    change (debug or TEMPLATES_AUTO_RELOAD), where it is read afresh every time.
+    """
+    reload = app.jinja_env.auto_reload
+    versions = app.extensions.setdefault('template_versions', {})
+    version = None if reload else versions.get(names)
+    if version is None:
+        digest = hashlib.sha1()
+        for name in names:
+            source, _, _ = app.jinja_env.loader.get_source(app.jinja_env, name)
+            digest.update(source.encode('utf-8'))
+        version = digest.hexdigest()[:12]
+        if not reload:
+            versions[names] = version
+    return version
+
+
+static_assets = StaticAssets()
+compressor = Compressor()
@@ -0,0 +1,44 @@
+"""Short-lived cache of the logged-in user's identity.
+
+`request_context_setup()` needs the current user on almost every request, but
+only its id, username and email. Those are loaded once, without the password
+hash, and cached for a short TTL so most requests skip the database entirely.
+Entries are invalidated when the profile changes or the account is deleted;
+the TTL bounds how stale other workers can be.
+"""
+from collections import namedtuple
+
+from cache import MemoryCache
+from models import db, User
+
+CurrentUser = namedtuple('CurrentUser', ['id', 'username', 'email'])
+
+
+class IdentityCache:
+    def __init__(self, ttl=30, max_entries=10000):
+        self.cache = MemoryCache(ttl=ttl, max_entries=max_entries)
+        self.skipped = 0
+
+    def get(self, user_id):
+        """Return the CurrentUser for `user_id`, or None if the user no longer exists."""
+        user = self.cache.get(user_id)
+        if user is None:
+            row = db.session.query(User.id, User.username, User.email).filter(User.id == user_id).first()
+            if row is None:
+                return None
+            user = CurrentUser(*row)
+            self.cache.set(user_id, user)
+        return user
+
+    def skip(self):
+        """Count a request that did not need the user loaded."""
+        self.skipped += 1
+
+    def invalidate(self, user_id):
+        self.cache.delete(user_id)
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats['skipped'] = self.skipped
+        stats['queries_saved'] = stats['hits'] + self.skipped
+        return stats
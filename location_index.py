@@ -0,0 +1,132 @@
+"""In-memory airport/city index for location autocomplete.
+
+Every IATA code, and every word of a city or airport name, is indexed by all
+of its prefixes, so a prefix lookup is a single dict access. Trigrams of the
+full name catch queries that are not a word prefix (typos, mid-word input).
+Results use the same shape as the Amadeus locations API so the browser can
+render them unchanged.
+"""
+import csv
+import re
+import threading
+
+DATASET_PATH = 'data/airports.csv'
+
+_WORD_RE = re.compile(r"[A-Z0-9]+")
+
+
+def normalize(text):
+    return ' '.join(_WORD_RE.findall((text or '').upper().replace("'", '')))
+
+
+def trigrams(text):
+    text = f'  {normalize(text)} '
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class LocationEntry:
+    __slots__ = ('iatacode', 'name', 'city', 'country', 'latitude', 'longitude', 'sub_type', 'words', 'trigrams')
+
+    def __init__(self, iatacode, name, city, country, latitude, longitude, sub_type='AIRPORT'):
+        self.iatacode = iatacode.upper()
+        self.name = name
+        self.city = city or ''
+        self.country = country or ''
+        self.latitude = float(latitude)
+        self.longitude = float(longitude)
+        self.sub_type = sub_type
+        self.words = set(normalize(f'{self.name} {self.city}').split())
+        self.trigrams = trigrams(f'{self.city} {self.name}')
+
+    def serialize(self):
+        """Serialize in the Amadeus locations API shape."""
+        return {
+            'subType': self.sub_type,
+            'name': self.name,
+            'iataCode': self.iatacode,
+            'geoCode': {'latitude': self.latitude, 'longitude': self.longitude},
+            'address': {'cityName': self.city, 'countryCode': self.country},
+        }
+
+
+class LocationIndex:
+    """Prefix and trigram index over IATA codes, airport names and cities."""
+
+    def __init__(self):
+        self.entries = {}    # iatacode -> LocationEntry
+        self._prefixes = {}  # prefix -> set of iatacodes
+        self._trigrams = {}  # trigram -> set of iatacodes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, entry):
+        """Add an entry; an entry with the same IATA code is kept as is."""
+        with self._lock:
+            if entry.iatacode in self.entries:
+                return False
+            self.entries[entry.iatacode] = entry
+            for token in entry.words | {entry.iatacode}:
+                for end in range(1, len(token) + 1):
+                    self._prefixes.setdefault(token[:end], set()).add(entry.iatacode)
+            for gram in entry.trigrams:
+                self._trigrams.setdefault(gram, set()).add(entry.iatacode)
+            return True
+
+    def load_csv(self, path=DATASET_PATH):
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                self.add(LocationEntry(row['iatacode'], row['name'], row['city'], row['country'],
+                                       row['latitude'], row['longitude']))
+
+    def search(self, query, limit=8):
+        """Return up to `limit` entries matching `query`, best first."""
+        words = normalize(query).split()
+        if not words:
+            return []
+        # add() updates the sets from other request threads
+        with self._lock:
+            # Every query word must prefix some word of the entry
+            candidates = None
+            for word in words:
+                matches = self._prefixes.get(word, set())
+                candidates = matches if candidates is None else candidates & matches
+            if candidates:
+                ranked = sorted((self._score(self.entries[code], words), code) for code in candidates)
+            else:
+                ranked = self._fuzzy(' '.join(words))
+            if ranked:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return [self.entries[code] for _, code in ranked[:limit]]
+
+    def _score(self, entry, words):
+        """Lower is better: exact code, then city prefix, then name prefix."""
+        query = ' '.join(words)
+        if entry.iatacode == query:
+            rank = 0
+        elif normalize(entry.city).startswith(query):
+            rank = 1
+        elif normalize(entry.name).startswith(query):
+            rank = 2
+        else:
+            rank = 3
+        return (rank, entry.sub_type != 'AIRPORT', len(entry.name))
+
+    def _fuzzy(self, query, threshold=0.5):
+        grams = trigrams(query)
+        counts = {}
+        for gram in grams:
+            for code in self._trigrams.get(gram, ()):
+                counts[code] = counts.get(code, 0) + 1
+        ranked = []
+        for code, shared in counts.items():
+            similarity = shared / len(grams)
+            if similarity >= threshold:
+                ranked.append(((4, -similarity), code))
+        ranked.sort()
+        return ranked
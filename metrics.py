@@ -0,0 +1,231 @@
+"""Per-request instrumentation and a Prometheus text exporter.
+
+For every request `Metrics` records wall time, the number and total time of
+SQL statements, time spent in upstream HTTP calls and template render time.
+Each goes into a histogram per endpoint (per template for rendering), and can
+be echoed back in a Server-Timing header. Other components register
+collectors: functions returning a flat dict of numbers, such as the cache
+stats. `render()` writes it all in the Prometheus text format for /metrics.
+
+Histograms live in the worker process, so each gunicorn worker reports its
+own numbers; a scrape sees the worker that answered it.
+"""
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+
+from flask import before_render_template, g, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Latency bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, float('inf'))
+
+PREFIX = 'flightcast_'
+
+
+class Histogram:
+    """Cumulative-bucket histogram."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def as_dict(self):
+        with self._lock:
+            cumulative, buckets = 0, {}
+            for bound, count in zip(self.buckets, self.counts):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            return {'count': self.count, 'sum': self.sum, 'buckets': buckets}
+
+
+class RequestTimings:
+    """What one request spent its time on."""
+    __slots__ = ('start', 'db_queries', 'db_time', 'upstream_calls', 'upstream_time', 'template_time',
+                 'template_starts')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.upstream_calls = 0
+        self.upstream_time = 0.0
+        self.template_time = 0.0
+        self.template_starts = []
+
+
+# Timings of the request being handled; asyncio.to_thread() carries it into worker threads
+_current = ContextVar('request_timings', default=None)
+
+
+def record_upstream(elapsed):
+    """Add an upstream HTTP call to the current request, if there is one."""
+    timings = _current.get()
+    if timings is not None:
+        timings.upstream_calls += 1
+        timings.upstream_time += elapsed
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_start'].pop()
+    timings = _current.get()
+    if timings is not None:
+        timings.db_queries += 1
+        timings.db_time += time.perf_counter() - started
+
+
+def _before_render(app, template, context, **extra):
+    timings = _current.get()
+    if timings is not None:
+        timings.template_starts.append(time.perf_counter())
+
+
+class Metrics:
+    def __init__(self):
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._collectors = {}  # (name, labels) -> function returning {stat: number}
+        self._histogram_collectors = {}  # name -> (label, function returning {label value: Histogram.as_dict()})
+        self._lock = threading.Lock()
+        self._listening = False
+
+    def init_app(self, app):
+        self.server_timing = app.config.get('SERVER_TIMING', False)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.teardown_request(self._teardown_request)
+        template_rendered.connect(self._template_rendered, app)
+        before_render_template.connect(_before_render, app)
+        with self._lock:
+            if not self._listening:
+                event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+                event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+                self._listening = True
+
+    def histogram(self, name, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            return histogram
+
+    def add_collector(self, name, collect, **labels):
+        """Export the numbers returned by `collect()` as `<name>_<stat>{labels}` on every scrape."""
+        with self._lock:
+            self._collectors[(name, tuple(sorted(labels.items())))] = collect
+
+    def add_histogram_collector(self, name, label, collect):
+        """Export histograms kept elsewhere, e.g. by the upstream client, one per value of `label`.
+
+        A histogram dict may carry a 'statuses' dict, exported as `<name>_responses{label, status}`.
+        """
+        with self._lock:
+            self._histogram_collectors[name] = (label, collect)
+
+    def _start_request(self):
+        g.metrics_token = _current.set(RequestTimings())
+
+    def _finish_request(self, response):
+        timings = _current.get()
+        if timings is None:
+            return response
+        elapsed = time.perf_counter() - timings.start
+        endpoint = request.endpoint or 'unmatched'
+        self.histogram('request_duration_seconds', endpoint=endpoint, status=str(response.status_code // 100) + 'xx'
+                       ).observe(elapsed)
+        self.histogram('request_db_queries', QUERY_COUNT_BUCKETS, endpoint=endpoint).observe(timings.db_queries)
+        self.histogram('request_db_seconds', endpoint=endpoint).observe(timings.db_time)
+        self.histogram('request_upstream_seconds', endpoint=endpoint).observe(timings.upstream_time)
+        if self.server_timing:
+            response.headers['Server-Timing'] = ', '.join([
+                f'app;dur={elapsed * 1000:.1f}',
+                f'db;dur={timings.db_time * 1000:.1f};desc="{timings.db_queries} queries"',
+                f'upstream;dur={timings.upstream_time * 1000:.1f};desc="{timings.upstream_calls} calls"',
+                f'tpl;dur={timings.template_time * 1000:.1f}',
+            ])
+        return response
+
+    def _teardown_request(self, exc):
+        token = g.pop('metrics_token', None)
+        if token is not None:
+            try:
+                _current.reset(token)
+            except ValueError:
+                # Torn down in a different context than it was set in
+                _current.set(None)
+
+    def _template_rendered(self, app, template, context, **extra):
+        timings = _current.get()
+        if timings is not None and timings.template_starts:
+            elapsed = time.perf_counter() - timings.template_starts.pop()
+            timings.template_time += elapsed
+            self.histogram('template_render_seconds', template=template.name or 'string').observe(elapsed)
+
+    def render(self):
+        """All histograms and collector values in the Prometheus text exposition format."""
+        families = {}
+        with self._lock:
+            histograms = list(self._histograms.items())
+            collectors = list(self._collectors.items())
+            histogram_collectors = list(self._histogram_collectors.items())
+        for (name, labels), histogram in sorted(histograms, key=lambda item: item[0]):
+            families.setdefault((name, 'histogram'), []).extend(histogram_samples(name, labels, histogram.as_dict()))
+        for name, (label, collect) in histogram_collectors:
+            for value, stats in sorted(collect().items()):
+                labels = ((label, value),)
+                families.setdefault((name, 'histogram'), []).extend(histogram_samples(name, labels, stats))
+                for status, count in sorted(stats.get('statuses', {}).items(), key=lambda item: str(item[0])):
+                    families.setdefault((f'{name}_responses', 'counter'), []).append(
+                        f'{PREFIX}{name}_responses{format_labels(labels + (("status", status),))} {count}')
+        for (name, labels), collect in collectors:
+            try:
+                values = collect()
+            except Exception as e:
+                print(f"Metrics collector {name} failed: {e}")
+                continue
+            for stat, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    families.setdefault((f'{name}_{stat}', 'untyped'), []).append(
+                        f'{PREFIX}{name}_{stat}{format_labels(labels)} {value}')
+        lines = []
+        for (name, kind), samples in families.items():
+            lines.append(f'# TYPE {PREFIX}{name} {kind}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+def histogram_samples(name, labels, stats):
+    """Prometheus samples for a histogram given as Histogram.as_dict()."""
+    samples = []
+    for bound, count in stats['buckets'].items():
+        le = '+Inf' if bound == 'inf' else bound
+        samples.append(f'{PREFIX}{name}_bucket{format_labels(tuple(labels) + (("le", le),))} {count}')
+    samples.append(f'{PREFIX}{name}_sum{format_labels(labels)} {stats["sum"]}')
+    samples.append(f'{PREFIX}{name}_count{format_labels(labels)} {stats["count"]}')
+    return samples
+
+
+metrics = Metrics()
@@ -0,0 +1,183 @@
+"""Schema migrations for databases created before the current models.
+
+Each migration is a version number, a description and a list of SQL
+statements that run in one transaction; a statement can also be a function of
+the connection, for steps plain SQL cannot make idempotent on every database.
+Applied versions are recorded in the schema_migrations table, so
+`flask db-upgrade` only runs what is pending. A database created with
+db.create_all() from the current models is stamped with every version instead,
+since it already has the final schema. Additive steps are also no-ops when
+their change is already there.
+"""
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from models import db as models_db
+from offers import parse_duration
+
+FLIGHT_NATURAL_KEY = ('user_id', 'flight_id', 'departure_location_id', 'arrival_location_id', 'depart_date',
+                      'return_date', 'passengers', 'num_stops', 'total_duration', 'price')
+# Since migration 3 prices are integer minor units with a currency code
+FLIGHT_NATURAL_KEY_V3 = FLIGHT_NATURAL_KEY[:-1] + ('price_minor', 'currency')
+# Since migration 4 durations are integer minutes
+FLIGHT_NATURAL_KEY_V4 = tuple('duration_minutes' if column == 'total_duration' else column
+                              for column in FLIGHT_NATURAL_KEY_V3)
+
+# Locations sharing an iatacode with a lower id
+_DUPLICATE_LOCATIONS = ('SELECT l1.id FROM locations l1 JOIN locations l2 '
+                        'ON l2.iatacode = l1.iatacode AND l2.id < l1.id')
+
+
+def _repoint_flights(column):
+    return (f'UPDATE flights SET {column} = ('
+            f'SELECT MIN(l2.id) FROM locations l1 JOIN locations l2 ON l2.iatacode = l1.iatacode '
+            f'WHERE l1.id = flights.{column}) '
+            f'WHERE {column} IN ({_DUPLICATE_LOCATIONS})')
+
+
+def _columns(conn, table):
+    return {col['name'] for col in inspect(conn).get_columns(table)}
+
+
+def _add_column(table, column, ddl_type):
+    def add(conn):
+        if column not in _columns(conn, table):
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl_type}'))
+    return add
+
+
+def _drop_column(table, column):
+    def drop(conn):
+        if column in _columns(conn, table):
+            conn.execute(text(f'ALTER TABLE {table} DROP COLUMN {column}'))
+    return drop
+
+
+def _backfill(table, column, expression, source):
+    """Set `column` from `expression` on every row, if the `source` column it reads is still there."""
+    def backfill(conn):
+        if source in _columns(conn, table):
+            conn.execute(text(f'UPDATE {table} SET {column} = {expression}'))
+    return backfill
+
+
+def _backfill_duration_minutes(conn):
+    # ISO 8601 durations cannot be parsed portably in SQL, so convert in Python, one update per distinct value
+    if 'total_duration' not in _columns(conn, 'flights'):
+        return
+    durations = [row[0] for row in conn.execute(text('SELECT DISTINCT total_duration FROM flights'))]
+    for duration in durations:
+        conn.execute(text('UPDATE flights SET duration_minutes = :minutes WHERE total_duration = :duration'),
+                     {'minutes': parse_duration(duration) or 0, 'duration': duration})
+
+
+def _create_table(table):
+    def create(conn):
+        models_db.metadata.tables[table].create(conn, checkfirst=True)
+    return create
+
+
+MIGRATIONS = [
+    (1, 'Index hot lookups and enforce unique locations and saved flights', [
+        # Merge locations that share an iatacode into the oldest one
+        _repoint_flights('departure_location_id'),
+        _repoint_flights('arrival_location_id'),
+        f'DELETE FROM locations WHERE id IN ({_DUPLICATE_LOCATIONS})',
+        # Keep the first copy of each duplicated saved flight
+        f'DELETE FROM flights WHERE id NOT IN (SELECT MIN(id) FROM flights GROUP BY {", ".join(FLIGHT_NATURAL_KEY)})',
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_locations_iatacode ON locations (iatacode)',
+        'CREATE INDEX IF NOT EXISTS ix_flights_user_id_id ON flights (user_id, id)',
+        f'CREATE UNIQUE INDEX IF NOT EXISTS uq_flights_natural_key ON flights ({", ".join(FLIGHT_NATURAL_KEY)})',
+    ]),
+    (2, 'Track re-priced saved flights and their price history', [
+        _add_column('flights', 'current_price', 'FLOAT'),
+        _add_column('flights', 'price_checked_at', 'TIMESTAMP'),
+        'CREATE INDEX IF NOT EXISTS ix_flights_depart_date_price_checked_at ON flights (depart_date, price_checked_at)',
+        _create_table('price_history'),
+    ]),
+    (3, 'Store prices as integer minor units with a currency code', [
+        _add_column('flights', 'price_minor', 'INTEGER NOT NULL DEFAULT 0'),
+        _add_column('flights', 'currency', "VARCHAR(3) NOT NULL DEFAULT 'EUR'"),
+        _add_column('flights', 'current_price_minor', 'INTEGER'),
+        _add_column('price_history', 'lowest_price_minor', 'INTEGER'),
+        _add_column('price_history', 'currency', 'VARCHAR(3)'),
+        # Every price so far was a float amount of EUR
+        _backfill('flights', 'price_minor', 'CAST(ROUND(price * 100) AS INTEGER)', 'price'),
+        _backfill('flights', 'current_price_minor', 'CAST(ROUND(current_price * 100) AS INTEGER)', 'current_price'),
+        _backfill('price_history', 'lowest_price_minor', 'CAST(ROUND(lowest_price * 100) AS INTEGER)', 'lowest_price'),
+        _backfill('price_history', 'currency', "CASE WHEN lowest_price IS NULL THEN NULL ELSE 'EUR' END",
+                  'lowest_price'),
+        'DROP INDEX IF EXISTS uq_flights_natural_key',
+        f'CREATE UNIQUE INDEX uq_flights_natural_key ON flights ({", ".join(FLIGHT_NATURAL_KEY_V3)})',
+        _drop_column('flights', 'price'),
+        _drop_column('flights', 'current_price'),
+        _drop_column('price_history', 'lowest_price'),
+    ]),
+    (4, 'Store flight durations as integer minutes and index the listing sorts', [
+        _add_column('flights', 'duration_minutes', 'INTEGER NOT NULL DEFAULT 0'),
+        _backfill_duration_minutes,
+        'DROP INDEX IF EXISTS uq_flights_natural_key',
+        f'CREATE UNIQUE INDEX uq_flights_natural_key ON flights ({", ".join(FLIGHT_NATURAL_KEY_V4)})',
+        'CREATE INDEX IF NOT EXISTS ix_flights_user_id_duration_minutes ON flights (user_id, duration_minutes, id)',
+        'CREATE INDEX IF NOT EXISTS ix_flights_user_id_num_stops ON flights (user_id, num_stops, id)',
+        _drop_column('flights', 'total_duration'),
+    ]),
+]
+
+
+def _ensure_version_table(conn):
+    conn.execute(text('CREATE TABLE IF NOT EXISTS schema_migrations ('
+                      'version INTEGER PRIMARY KEY, description TEXT NOT NULL, applied_at TIMESTAMP NOT NULL)'))
+
+
+def applied_versions(db):
+    with db.engine.begin() as conn:
+        _ensure_version_table(conn)
+        return {row[0] for row in conn.execute(text('SELECT version FROM schema_migrations'))}
+
+
+def _record(conn, version, description):
+    conn.execute(text('INSERT INTO schema_migrations (version, description, applied_at) '
+                      'VALUES (:version, :description, :applied_at)'),
+                 {'version': version, 'description': description, 'applied_at': datetime.utcnow()})
+
+
+def stamp(db):
+    """Record every migration as applied, for a database just created from the current models."""
+    done = applied_versions(db)
+    with db.engine.begin() as conn:
+        for version, description, _ in MIGRATIONS:
+            if version not in done:
+                _record(conn, version, description)
+
+
+def upgrade(db):
+    """Apply pending migrations in order; returns the list of versions applied."""
+    done = applied_versions(db)
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version in done:
+            continue
+        with db.engine.begin() as conn:
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(text(statement))
+            _record(conn, version, description)
+        applied.append(version)
+    return applied
+
+
+def explain(db, query):
+    """Return the database's query plan for a SQLAlchemy query as a list of lines."""
+    dialect = db.engine.dialect
+    compiled = query.statement.compile(dialect=dialect)
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect.name == 'sqlite' else 'EXPLAIN '
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    with db.engine.connect() as conn:
+        rows = conn.exec_driver_sql(prefix + str(compiled), params).fetchall()
+    return [' | '.join(str(col) for col in row) for row in rows]
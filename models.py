@@ -1,11 +1,26 @@
 from flask_sqlalchemy import SQLAlchemy
-from flask_bcrypt import Bcrypt
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from database import RoutingSession
+from hashing import hasher
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# A user can save the same flight only once
+FLIGHT_NATURAL_KEY = ('user_id', 'flight_id', 'departure_location_id', 'arrival_location_id', 'depart_date',
+                      'return_date', 'passengers', 'num_stops', 'duration_minutes', 'price_minor', 'currency')
 
 class Flight(db.Model):
     __tablename__ = 'flights'
+    __table_args__ = (
+        # Saved flights listing: filter by user, newest first
+        db.Index('ix_flights_user_id_id', 'user_id', 'id'),
+        db.Index('uq_flights_natural_key', *FLIGHT_NATURAL_KEY, unique=True),
+        # Saved flights listing sorted or filtered by duration or stops
+        db.Index('ix_flights_user_id_duration_minutes', 'user_id', 'duration_minutes', 'id'),
+        db.Index('ix_flights_user_id_num_stops', 'user_id', 'num_stops', 'id'),
+        # Price watch: upcoming flights not re-priced recently
+        db.Index('ix_flights_depart_date_price_checked_at', 'depart_date', 'price_checked_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     flight_id = db.Column(db.Integer, nullable=False)
@@ -15,8 +30,12 @@ class Flight(db.Model):
     return_date = db.Column(db.DateTime, nullable=False)
     passengers = db.Column(db.Integer, nullable=False, default=1)
     num_stops = db.Column(db.Integer, nullable=False, default=0)
-    total_duration = db.Column(db.String, nullable=False)
-    price = db.Column(db.Float, nullable=False)
+    duration_minutes = db.Column(db.Integer, nullable=False)
+    # Prices are integer minor units (cents) of `currency`, see fx.py
+    price_minor = db.Column(db.Integer, nullable=False)
+    currency = db.Column(db.String(3), nullable=False, default='EUR')
+    current_price_minor = db.Column(db.Integer, nullable=True)
+    price_checked_at = db.Column(db.DateTime, nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
 
     departure_location = db.relationship('Location', foreign_keys=[departure_location_id], backref='departure_flight')
@@ -24,10 +43,63 @@ class Flight(db.Model):
 
 
     def __repr__(self):
-        return f'<Flight_id={self.id}, depart_date={self.depart_date}, return_date={self.return_date}, passengers={self.passengers}, num_stops={self.num_stops}, total_duration={self.total_duration}, price={self.price})>'
+        return f'<Flight_id={self.id}, depart_date={self.depart_date}, return_date={self.return_date}, passengers={self.passengers}, num_stops={self.num_stops}, duration_minutes={self.duration_minutes}, price_minor={self.price_minor}, currency={self.currency})>'
+
+    def serialize(self):
+        """Serialize saved flight, including its locations, to a dict."""
+        return {
+            'id': self.id,
+            'flight_id': self.flight_id,
+            'departure_location': self.departure_location.serialize(),
+            'arrival_location': self.arrival_location.serialize(),
+            'depart_date': self.depart_date.isoformat(),
+            'return_date': self.return_date.isoformat(),
+            'passengers': self.passengers,
+            'num_stops': self.num_stops,
+            'duration_minutes': self.duration_minutes,
+            'price_minor': self.price_minor,
+            'currency': self.currency,
+            'current_price_minor': self.current_price_minor,
+            'price_checked_at': self.price_checked_at.isoformat() if self.price_checked_at else None,
+        }
+
+
+class PriceHistory(db.Model):
+    """Lowest price found for a trip each time the price watch re-searches it."""
+    __tablename__ = 'price_history'
+    __table_args__ = (
+        db.Index('ix_price_history_trip', 'departure_location_id', 'arrival_location_id',
+                 'depart_date', 'return_date', 'passengers', 'checked_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    departure_location_id = db.Column(db.Integer, db.ForeignKey('locations.id'), nullable=False)
+    arrival_location_id = db.Column(db.Integer, db.ForeignKey('locations.id'), nullable=False)
+    depart_date = db.Column(db.DateTime, nullable=False)
+    return_date = db.Column(db.DateTime, nullable=False)
+    passengers = db.Column(db.Integer, nullable=False)
+    checked_at = db.Column(db.DateTime, nullable=False)
+    lowest_price_minor = db.Column(db.Integer, nullable=True)
+    currency = db.Column(db.String(3), nullable=True)
+    offers = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<PriceHistory_id={self.id}, depart_date={self.depart_date}, return_date={self.return_date}, checked_at={self.checked_at}, lowest_price_minor={self.lowest_price_minor}, currency={self.currency}>'
+
+    def serialize(self):
+        return {
+            'checked_at': self.checked_at.isoformat(),
+            'lowest_price_minor': self.lowest_price_minor,
+            'currency': self.currency,
+            'offers': self.offers,
+        }
+
 
 class Location(db.Model):
     __tablename__ = 'locations'
+    __table_args__ = (
+        db.Index('uq_locations_iatacode', 'iatacode', unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.Text, nullable=False, unique=True)
@@ -38,6 +110,16 @@ class Location(db.Model):
     def __repr__(self):
         return f'<Location_id={self.id}, name={self.name}, iatacode={self.iatacode}, latitude={self.latitude}, longitude={self.longitude}>'
 
+    def serialize(self):
+        """Serialize location to a dict."""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'iatacode': self.iatacode,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+        }
+
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -55,7 +137,7 @@ class User(db.Model):
     def signup(cls, username, password, email):
         """Sign up user. Hashes password and adds user to system."""
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -73,7 +155,7 @@ class User(db.Model):
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.verify(password, user.password)
             if is_auth:
                 return user
 
@@ -0,0 +1,203 @@
+"""Streaming dedup/normalize stage for Amadeus flight-offers responses.
+
+Offers are reduced to the few fields the app uses (durations as integer
+minutes, so nothing re-parses ISO 8601 durations later) and deduplicated on an
+itinerary fingerprint: carrier, flight number and times of every segment of
+every itinerary. Only the cheapest offer per fingerprint is kept.
+
+Bodies up to STREAM_THRESHOLD bytes are decoded with json.loads, which is
+several times faster than ijson's event parsing; larger ones are read one
+offer at a time with ijson, when it is installed, so the full decoded response
+never has to be held in memory.
+
+What is kept is an `Offer` of slotted, frozen dataclasses: prices in integer
+minor units, times as datetimes and interned codes. That is what the search
+cache holds and what the templates render; `serialize()` gives the JSON shape.
+`python bench/benchmark.py dedup` reports the memory it takes per search.
+"""
+import json
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from sys import intern
+
+from fx import from_minor, to_minor
+
+try:
+    import ijson
+except ImportError:  # decode the whole body instead
+    ijson = None
+
+# Bodies larger than this are streamed with ijson instead of decoded whole
+STREAM_THRESHOLD = 4 * 1024 * 1024
+
+# Bump when the normalized record changes, so cached searches in the old format are not read back
+OFFER_FORMAT = 3
+
+_DURATION = re.compile(r'^P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:\d+(?:\.\d+)?S)?)?$')
+
+
+def parse_duration(value):
+    """Minutes in an ISO 8601 duration such as 'PT14H10M' or 'P1DT2H', or None if it is not one."""
+    match = _DURATION.match(value or '')
+    if not match or value in ('P', 'PT'):
+        return None
+    days, hours, minutes = (int(group or 0) for group in match.groups())
+    return (days * 24 + hours) * 60 + minutes
+
+
+def iter_offers(source):
+    """Yield raw offers from a file-like JSON response body, or from an already decoded response."""
+    if isinstance(source, dict):
+        yield from source.get('data', [])
+        return
+    if ijson is None:
+        yield from json.load(source).get('data', [])
+        return
+    head = _read_up_to(source, STREAM_THRESHOLD + 1)
+    if len(head) <= STREAM_THRESHOLD:
+        yield from json.loads(head).get('data', [])
+    else:
+        yield from ijson.items(_Prefixed(head, source), 'data.item')
+
+
+def _read_up_to(source, size):
+    # Raw HTTP streams may return short reads before the end of the body
+    chunks = []
+    while size > 0:
+        chunk = source.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+class _Prefixed:
+    """File-like reader returning `head` and then the rest of `source`."""
+
+    def __init__(self, head, source):
+        self.head = head
+        self.source = source
+
+    def read(self, size=-1):
+        if self.head and size:
+            chunk, self.head = self.head, b''
+            return chunk
+        return self.source.read(size)
+
+
+def fingerprint(offer):
+    return tuple(
+        tuple((segment['carrierCode'], segment['number'], segment['departure']['at'], segment['arrival']['at'])
+              for segment in itinerary['segments'])
+        for itinerary in offer['itineraries'])
+
+
+@dataclass(slots=True, frozen=True)
+class Segment:
+    carrier: str
+    number: str
+    origin: str
+    destination: str
+    depart_at: datetime
+    arrive_at: datetime
+    duration_minutes: int
+
+    def serialize(self):
+        return {
+            'carrier': self.carrier,
+            'number': self.number,
+            'from': self.origin,
+            'to': self.destination,
+            'depart_at': self.depart_at.isoformat(),
+            'arrive_at': self.arrive_at.isoformat(),
+            'duration_minutes': self.duration_minutes,
+        }
+
+
+@dataclass(slots=True, frozen=True)
+class Itinerary:
+    duration_minutes: int
+    segments: tuple
+
+    @property
+    def stops(self):
+        return len(self.segments) - 1
+
+    def serialize(self):
+        return {
+            'duration_minutes': self.duration_minutes,
+            'segments': [segment.serialize() for segment in self.segments],
+        }
+
+
+@dataclass(slots=True, frozen=True)
+class Offer:
+    """The fields of an Amadeus offer that the results page, save_flight() and the price watch use."""
+    id: str
+    price_minor: int
+    currency: str
+    passengers: int
+    itineraries: tuple
+
+    @property
+    def price(self):
+        """Price in major units as a string, e.g. '289.71'."""
+        return str(from_minor(self.price_minor, self.currency))
+
+    def serialize(self):
+        return {
+            'id': self.id,
+            'price': self.price,
+            'currency': self.currency,
+            'passengers': self.passengers,
+            'itineraries': [itinerary.serialize() for itinerary in self.itineraries],
+        }
+
+
+def normalize_offer(offer):
+    """Reduce an Amadeus offer to an Offer.
+
+    Airport and carrier codes repeat across offers, so they are interned and
+    every offer of a search shares one copy of each.
+    """
+    currency = intern(offer['price'].get('currency', 'EUR'))
+    return Offer(
+        id=str(offer['id']),
+        price_minor=to_minor(offer['price']['total'], currency),
+        currency=currency,
+        passengers=len(offer.get('travelerPricings', [])) or 1,
+        itineraries=tuple(
+            Itinerary(
+                duration_minutes=parse_duration(itinerary.get('duration')),
+                segments=tuple(
+                    Segment(
+                        carrier=intern(segment['carrierCode']),
+                        number=segment['number'],
+                        origin=intern(segment['departure']['iataCode']),
+                        destination=intern(segment['arrival']['iataCode']),
+                        depart_at=datetime.fromisoformat(segment['departure']['at']),
+                        arrive_at=datetime.fromisoformat(segment['arrival']['at']),
+                        duration_minutes=parse_duration(segment.get('duration')),
+                    )
+                    for segment in itinerary['segments']
+                ),
+            )
+            for itinerary in offer['itineraries']
+        ),
+    )
+
+
+def dedupe_offers(source, origin=None):
+    """Yield normalized offers departing from `origin`, cheapest per itinerary fingerprint, cheapest first."""
+    cheapest = {}  # fingerprint -> (price, position, record)
+    for position, offer in enumerate(iter_offers(source)):
+        if origin and offer['itineraries'][0]['segments'][0]['departure']['iataCode'] != origin:
+            continue
+        key = fingerprint(offer)
+        price = float(offer['price']['total'])
+        if key not in cheapest or price < cheapest[key][0]:
+            cheapest[key] = (price, position, normalize_offer(offer))
+    for _, _, record in sorted(cheapest.values(), key=lambda item: item[:2]):
+        yield record
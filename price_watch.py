@@ -0,0 +1,139 @@
+"""Background re-pricing of saved flights.
+
+A saved flight only holds the price seen when it was saved. `flask price-watch`
+runs in its own process, outside the web workers, and keeps re-searching the
+trips of saved flights that have not departed yet:
+
+- Flights are grouped by route, dates and passengers, so one search re-prices
+  every user's copy of the same trip.
+- Trips checked longest ago go first, a batch at a time, and every upstream
+  search takes a token from the watcher's own rate limiter, so the watcher uses
+  a fixed slice of the Amadeus budget however many flights are saved.
+- Each search adds one price_history row for the trip and sets
+  current_price_minor on its saved flights to the cheapest offer in their
+  currency with the same stops and duration.
+"""
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_
+from sqlalchemy.orm import aliased
+
+from models import db, Flight, Location, PriceHistory
+
+NEVER_CHECKED = datetime(1970, 1, 1)
+
+Trip = namedtuple('Trip', ['departure_location_id', 'arrival_location_id', 'depart_date', 'return_date',
+                           'passengers', 'origin', 'destination', 'flights'])
+
+TRIP_COLUMNS = (Flight.departure_location_id, Flight.arrival_location_id, Flight.depart_date,
+                Flight.return_date, Flight.passengers)
+
+
+def due_trips(stale_after, limit, now=None):
+    """Return up to `limit` upcoming trips with a saved flight not re-priced within `stale_after`, oldest check first."""
+    now = now or datetime.utcnow()
+    departure = aliased(Location)
+    arrival = aliased(Location)
+    query = (db.session.query(*TRIP_COLUMNS, departure.iatacode, arrival.iatacode, func.count(Flight.id))
+             .join(departure, Flight.departure_location_id == departure.id)
+             .join(arrival, Flight.arrival_location_id == arrival.id)
+             .filter(Flight.depart_date > now,
+                     or_(Flight.price_checked_at.is_(None), Flight.price_checked_at < now - stale_after))
+             .group_by(*TRIP_COLUMNS, departure.iatacode, arrival.iatacode)
+             .order_by(func.min(func.coalesce(Flight.price_checked_at, NEVER_CHECKED)))
+             .limit(limit))
+    return [Trip(*row) for row in query]
+
+
+def search_params(trip):
+    return {
+        'originLocationCode': trip.origin,
+        'destinationLocationCode': trip.destination,
+        'departureDate': trip.depart_date.date(),
+        'returnDate': trip.return_date.date(),
+        'adults': trip.passengers,
+        'max': 25
+    }
+
+
+def matching_price(offers, num_stops, duration_minutes, currency):
+    """Minor units of the cheapest offer in `currency` whose outbound itinerary has the saved stops and duration."""
+    prices = [offer.price_minor for offer in offers
+              if offer.currency == currency
+              and offer.itineraries[0].stops == num_stops
+              and offer.itineraries[0].duration_minutes == duration_minutes]
+    return min(prices) if prices else None
+
+
+def record_prices(trip, flight_data, now=None):
+    """Store the result of re-searching `trip`; `flight_data` is None when the search failed."""
+    now = now or datetime.utcnow()
+    flights = Flight.query.filter(*(column == value for column, value in zip(TRIP_COLUMNS, trip)))
+    if flight_data is None:
+        # Still mark the flights checked, so a failing trip waits its turn instead of blocking the batch
+        flights.update({Flight.price_checked_at: now}, synchronize_session=False)
+        db.session.commit()
+        return
+    offers = flight_data.get('data') or []
+    cheapest = min(offers, key=lambda offer: offer.price_minor, default=None)
+    db.session.add(PriceHistory(
+        departure_location_id=trip.departure_location_id,
+        arrival_location_id=trip.arrival_location_id,
+        depart_date=trip.depart_date,
+        return_date=trip.return_date,
+        passengers=trip.passengers,
+        checked_at=now,
+        lowest_price_minor=cheapest.price_minor if cheapest else None,
+        currency=cheapest.currency if cheapest else None,
+        offers=len(offers)))
+    variants = flights.with_entities(Flight.num_stops, Flight.duration_minutes, Flight.currency).distinct().all()
+    for num_stops, duration_minutes, currency in variants:
+        flights.filter(Flight.num_stops == num_stops, Flight.duration_minutes == duration_minutes,
+                       Flight.currency == currency).update(
+            {Flight.current_price_minor: matching_price(offers, num_stops, duration_minutes, currency),
+             Flight.price_checked_at: now},
+            synchronize_session=False)
+    db.session.commit()
+
+
+class PriceWatcher:
+    """Re-prices due trips in batches, taking a rate limiter token for every upstream search."""
+
+    def __init__(self, search, lookup, limiter, batch_size=50, stale_after=timedelta(hours=6)):
+        self.search = search
+        self.lookup = lookup
+        self.limiter = limiter
+        self.batch_size = batch_size
+        self.stale_after = stale_after
+        self.counts = {'trips': 0, 'flights': 0, 'searches': 0, 'cached': 0, 'failed': 0}
+
+    def run_once(self):
+        """Re-price one batch of due trips; returns how many trips were processed."""
+        trips = due_trips(self.stale_after, self.batch_size)
+        for trip in trips:
+            params = search_params(trip)
+            flight_data = self.lookup(params)
+            if flight_data is not None:
+                self.counts['cached'] += 1
+            else:
+                self.limiter.acquire()
+                self.counts['searches'] += 1
+                flight_data = self.search(params)
+                if flight_data is None:
+                    self.counts['failed'] += 1
+            record_prices(trip, flight_data)
+            self.counts['trips'] += 1
+            self.counts['flights'] += trip.flights
+        return len(trips)
+
+    def run_forever(self, interval):
+        """Keep re-pricing; sleep `interval` seconds whenever there is less than a full batch due."""
+        while True:
+            if self.run_once() < self.batch_size:
+                print(f"Price watch: {self.counts}")
+                time.sleep(interval)
+
+    def stats(self):
+        return dict(self.counts)
@@ -0,0 +1,54 @@
+"""Where the context of a flight search (locations, dates, passengers) lives between
+the search results page and saving a flight.
+
+`CookieSearchStore` keeps it in the signed session cookie, one search at a time.
+`ServerSearchStore` keeps it in a TTL cache under a short random search id, so
+the cookie stays small and each browser tab can hold its own search.
+"""
+import secrets
+
+from flask import session
+
+from cache import MemoryCache, SQLiteCache
+
+DEFAULT_TTL = 2 * 60 * 60
+
+
+class CookieSearchStore:
+    """Keep the last search in the session cookie."""
+
+    def save(self, context):
+        session['search'] = context
+        return 'session'
+
+    def load(self, search_id=None):
+        return session.get('search')
+
+
+class ServerSearchStore:
+    """Keep searches server side, keyed by a search id embedded in the results page."""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def save(self, context):
+        search_id = secrets.token_urlsafe(9)
+        self.cache.set(f'search:{search_id}', context)
+        session['search_id'] = search_id
+        return search_id
+
+    def load(self, search_id=None):
+        search_id = search_id or session.get('search_id')
+        if not search_id:
+            return None
+        return self.cache.get(f'search:{search_id}')
+
+
+def make_search_store(backend='cookie', path=None, ttl=DEFAULT_TTL, max_entries=10000):
+    """Build a search store; `backend` is 'cookie', 'memory' or 'sqlite' (shared by all workers)."""
+    if backend == 'sqlite':
+        return ServerSearchStore(SQLiteCache(path or 'flightcast-cache.db', ttl=ttl, max_entries=max_entries,
+                                             table='search_contexts'))
+    if backend == 'memory':
+        return ServerSearchStore(MemoryCache(ttl=ttl, max_entries=max_entries))
+    return CookieSearchStore()
@@ -0,0 +1,142 @@
+"""Coalesce identical upstream calls that are in flight at the same time.
+
+When many users search the same route at once, each request would make the
+same flight-offers call. `SingleFlight.do(key, fn)` lets the first caller for
+a key (the leader) run `fn` while later callers for that key wait for it and
+share its result, or its exception. A follower waits at most `wait` seconds;
+if the leader is still busy by then the follower makes the call itself, so a
+stuck leader delays followers but never blocks them for good.
+
+That covers the threads of one worker. Given a `FileLocks` directory, leaders
+in different workers on the host also take a file lock per key, and once they
+hold it call `recheck()` first: when the results are kept in a cache all
+workers share (the sqlite backend), the worker that held the lock before has
+already stored them and no second call is made.
+"""
+import fcntl
+import hashlib
+import os
+import threading
+import time
+
+DEFAULT_WAIT = 30
+
+# Keys are hashed onto this many lock files, so the directory stays small
+LOCK_STRIPES = 256
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, wait=DEFAULT_WAIT, locks=None):
+        self.wait = wait
+        self.locks = locks
+        self._calls = {}  # key -> _Call of the leader
+        self._lock = threading.Lock()
+        self.counts = {'leaders': 0, 'coalesced': 0, 'timeouts': 0, 'failures': 0, 'shared_across_workers': 0}
+
+    def do(self, key, fn, recheck=None):
+        """Return `fn()`, sharing one call between everyone asking for `key` at the same time.
+
+        `recheck()` is called after waiting for another worker's lock; a result
+        other than None is returned instead of calling `fn`.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.counts['leaders'] += 1
+                leader = True
+            else:
+                call.waiters += 1
+                leader = False
+
+        if not leader:
+            if not call.done.wait(self.wait):
+                self._count('timeouts')
+                return fn()
+            self._count('coalesced')
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run(key, fn, recheck)
+        except Exception as e:
+            call.error = e
+            self._count('failures')
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._calls)
+            waiting = sum(call.waiters for call in self._calls.values())
+            return dict(self.counts, in_flight=in_flight, waiting=waiting)
+
+    def _run(self, key, fn, recheck):
+        if self.locks is None:
+            return fn()
+        held, contended = self.locks.acquire(key, self.wait)
+        try:
+            if contended and recheck is not None:
+                result = recheck()
+                if result is not None:
+                    self._count('shared_across_workers')
+                    return result
+            return fn()
+        finally:
+            if held is not None:
+                self.locks.release(held)
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+
+class FileLocks:
+    """Exclusive per-key locks shared by the worker processes on one host, using flock() on files in `directory`."""
+
+    def __init__(self, directory, stripes=LOCK_STRIPES):
+        self.directory = directory
+        self.stripes = stripes
+        os.makedirs(directory, exist_ok=True)
+
+    def acquire(self, key, timeout):
+        """Wait up to `timeout` seconds for the lock on `key`.
+
+        Returns (handle to pass to release(), whether another process held it);
+        the handle is None when the wait timed out and the caller goes ahead unlocked.
+        """
+        stripe = int(hashlib.sha1(key.encode('utf-8')).hexdigest(), 16) % self.stripes
+        handle = open(os.path.join(self.directory, f'{stripe:02x}.lock'), 'a')
+        deadline = time.monotonic() + timeout
+        contended = False
+        while True:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return handle, contended
+            except BlockingIOError:
+                contended = True
+                if time.monotonic() >= deadline:
+                    handle.close()
+                    return None, contended
+                time.sleep(0.05)
+
+    def release(self, handle):
+        try:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+        finally:
+            handle.close()
@@ -1,39 +1,6 @@
 document.addEventListener("DOMContentLoaded", async function () {
     flatpickr('.flatpickr-input');
 
-    const token = await fetchToken();
-    const weather_token = await fetchWeatherToken();
-
-// Fetch token from Python/Server
-    async function fetchToken() {
-        try {
-            const response = await fetch('/token');
-            if (!response.ok) {
-                throw new Error('Network response was not ok');
-            }
-            const data = await response.json();
-            return data.token;
-        } catch (error) {
-            console.error('Fetch error:', error);
-            return null;
-        }
-    }
-
-// Fetch weather_token from Python/Server
-    async function fetchWeatherToken() {
-        try {
-            const response = await fetch('/token');
-            if (!response.ok) {
-                throw new Error('Network response was not ok');
-            }
-            const data = await response.json();
-            return data.weather_token;
-        } catch (error) {
-            console.error('Fetch error:', error);
-            return null;
-        }
-    }
-
 // Fetch suggestions based on user input for locations
     const suggestionsCache = {};
     async function fetchSuggestions(userInput) {
@@ -41,14 +8,9 @@ document.addEventListener("DOMContentLoaded", async function () {
             if (suggestionsCache[userInput]) {
                 return suggestionsCache[userInput];
             }
-            const baseUrl = "https://test.api.amadeus.com/v1/reference-data/locations";
-            const url = `${baseUrl}?subType=CITY,AIRPORT&keyword=${userInput}`;
+            const url = `/locations/suggest?q=${encodeURIComponent(userInput)}`;
             try {
-                const response = await fetch(url, {
-                headers: {
-                    'Authorization': `Bearer ${token}`
-                }
-                });
+                const response = await fetch(url);
                 if (!response.ok) {
                     throw new Error('Failed to fetch locations');
                 }
@@ -279,18 +241,46 @@ document.addEventListener("DOMContentLoaded", async function () {
         }
     }
 
- // Show weather data for saved flights
-    const savedFlights = document.querySelectorAll('.saved-flight-container');
-    savedFlights.forEach(async flight => {
+ // Show weather data for saved flights, fetched from the server in one batch
+    function weatherRequestFor(flight) {
         const latLong = flight.querySelector('.arrivalLatLong').textContent;
-        const daysText = flight.querySelector('.days').textContent;
-        const dates = daysText.split(' - ');
-        const depart = dates[0].split(' ')[0];
-        const returnDate = dates[1].split(' ')[0];
+        // The text is formatted for display; the ISO dates are in data attributes
+        const days = flight.querySelector('.days').dataset;
+        return { lat_long: latLong, start: days.start, end: days.end };
+    }
 
-        const weatherData = await fetchWeather(latLong, depart, returnDate);
-        displayWeather(weatherData, flight);
-    });
+    async function loadSavedFlightsWeather(flights, weatherRequests) {
+        try {
+            const results = await fetchWeatherBatch(weatherRequests);
+            results.forEach((weatherData, i) => {
+                if (weatherData) {
+                    displayWeather(weatherData, flights[i]);
+                }
+            });
+        } catch (error) {
+            console.error('Error fetching weather data:', error);
+        }
+    }
+
+    const savedFlights = Array.from(document.querySelectorAll('.saved-flight-container'));
+    if (savedFlights.length > 0) {
+        loadSavedFlightsWeather(savedFlights, savedFlights.map(weatherRequestFor));
+    }
+
+    async function fetchWeatherBatch(weatherRequests) {
+        const response = await fetch('/weather', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ requests: weatherRequests }),
+        });
+        if (!response.ok) {
+            throw new Error(`Failed to fetch weather data. Status: ${response.status}`);
+        }
+        const data = await response.json();
+        return data.results;
+    }
 
     function getWeatherIconImage(iconText) {
         const iconUrl = `/static/weather-icons/${iconText}.png`;
@@ -306,7 +296,7 @@ document.addEventListener("DOMContentLoaded", async function () {
             return Promise.resolve(JSON.parse(cachedData));
         } else {
             try {
-                const url = `https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/timeline/${latLong}/${depart}/${returnDate}?unitGroup=us&include=days&key=${weather_token}&contentType=json`;
+                const url = `/weather?lat_long=${encodeURIComponent(latLong)}&start=${depart}&end=${returnDate}`;
                 const response = await fetch(url);
                 if (!response.ok) {
                     if (response.status === 429) {
@@ -371,10 +361,13 @@ document.addEventListener("DOMContentLoaded", async function () {
     const saveFlightButtons = document.querySelectorAll('.save-flight-btn');
     saveFlightButtons.forEach(button => {
         button.addEventListener('click', async function() {
-            const numStopsValue = document.querySelector('.num-stops').dataset.numStops;
-            const durationValue = document.querySelector('.total-duration').dataset.totalDuration;
-            const priceValue = document.querySelector('.price').dataset.price;
-            const flightId = document.querySelector('.flight-id').dataset.flightId;
+            const flight = button.closest('.flight-container');
+            const numStopsValue = flight.querySelector('.num-stops').dataset.numStops;
+            const durationMinutes = flight.querySelector('.total-duration').dataset.durationMinutes;
+            const priceValue = flight.querySelector('.price').dataset.price;
+            const currencyValue = flight.querySelector('.price').dataset.currency;
+            const flightId = flight.querySelector('.flight-id').dataset.flightId;
+            const searchId = document.querySelector('.search-results-container').dataset.searchId;
             try {
                 // Perform an AJAX request using the Fetch API
                 const response = await fetch('/save_flight', {
@@ -384,9 +377,11 @@ document.addEventListener("DOMContentLoaded", async function () {
                     },
                     body: JSON.stringify({
                         flight_id: flightId,
+                        search_id: searchId,
                         numStopsValue: numStopsValue,
-                        durationValue: durationValue,
-                        priceValue: priceValue
+                        durationMinutes: durationMinutes,
+                        priceValue: priceValue,
+                        currencyValue: currencyValue
                     }),
                 });
                 if (!response.ok) {
@@ -394,8 +389,7 @@ document.addEventListener("DOMContentLoaded", async function () {
                 }
                 else {
                     showFlashMessage('Flight successfully saved.', 'success');
-                    const flightContainer = button.closest('.flight-container');
-                    flightContainer.remove();
+                    flight.remove();
                 }
             } catch (error) {
                 console.error('Fetch error:', error);
@@ -404,8 +398,7 @@ document.addEventListener("DOMContentLoaded", async function () {
     });
 
  // Handle the flight delete button    
-    const deleteFlightButtons = document.querySelectorAll('.delete-flight-btn');
-    deleteFlightButtons.forEach(button => {
+    function setupDeleteButton(button) {
         button.addEventListener('click', async function() {
             try {
                 const flightId = button.getAttribute('data-flight-id');
@@ -427,7 +420,69 @@ document.addEventListener("DOMContentLoaded", async function () {
                 showFlashMessage('Failed to delete flight data: ' + error.message, 'error');
             }
         });
-    });
+    }
+    document.querySelectorAll('.delete-flight-btn').forEach(setupDeleteButton);
+
+// Load the next page of saved flights from the server and append them to the list
+    const loadMoreButton = document.getElementById('load-more-flights');
+    if (loadMoreButton) {
+        loadMoreButton.addEventListener('click', async function() {
+            try {
+                const response = await fetch(`/flights?before=${loadMoreButton.dataset.nextBefore}`);
+                if (!response.ok) {
+                    throw new Error(`HTTP error! Status: ${response.status}`);
+                }
+                const data = await response.json();
+                const container = document.getElementById('saved-flights-container');
+                const flights = [];
+                for (const flight of data.flights) {
+                    const flightElement = await renderSavedFlight(flight);
+                    container.appendChild(flightElement);
+                    flights.push(flightElement);
+                }
+                loadSavedFlightsWeather(flights, data.flights.map(flight => ({
+                    lat_long: `${flight.arrival_location.latitude},${flight.arrival_location.longitude}`,
+                    start: flight.depart_date.split('T')[0],
+                    end: flight.return_date.split('T')[0]
+                })));
+                if (data.next_before) {
+                    loadMoreButton.dataset.nextBefore = data.next_before;
+                } else {
+                    loadMoreButton.remove();
+                }
+            } catch (error) {
+                showFlashMessage('Failed to load saved flights: ' + error.message, 'error');
+            }
+        });
+    }
+
+    async function renderSavedFlight(flight) {
+        const departure = flight.departure_location;
+        const arrival = flight.arrival_location;
+        const flightElement = document.createElement('div');
+        flightElement.className = 'saved-flight-container';
+        flightElement.innerHTML = `
+            <p class="fromTo"></p>
+            <p class="time days"></p>
+            <div class="details-container">
+                <div class="text-container">
+                    <p><strong>Departing Flight Details</strong></p>
+                    <p>Flight ID: ${flight.flight_id}</p>
+                    <p class="num-stops">Stops: ${flight.display_stops}</p>
+                    <p class="total-duration">Total Duration: ${flight.display_duration}</p>
+                    <p>Passengers: ${flight.passengers}</p>
+                    <p class="price"></p>
+                    <button class="btn btn-danger btn-sm delete-flight-btn" data-flight-id="${flight.id}">Delete</button>
+                </div>
+                <div class="weather-container"></div>
+            </div>`;
+        flightElement.querySelector('.time').textContent = flight.display_dates;
+        flightElement.querySelector('.price').textContent = `Price: ${flight.display_price}`;
+        flightElement.querySelector('.fromTo').textContent =
+            `(${departure.iatacode}) ${departure.name} - (${arrival.iatacode}) ${arrival.name}`;
+        setupDeleteButton(flightElement.querySelector('.delete-flight-btn'));
+        return flightElement;
+    }
 
 
 // Display flash message to user
@@ -445,53 +500,6 @@ document.addEventListener("DOMContentLoaded", async function () {
         }, displayTime);
     }
 
-// Format flight duration from JSON data (e.g., PT6H28M to 6 hr 28 min)
-    function formatDuration(duration_str) {
-        if (duration_str && typeof duration_str === 'string' && duration_str.includes('PT')) {
-            const regex = /PT(\d+H)?(\d+M)?/;
-            const match = duration_str.match(regex);
-            if (match) {
-                const hours = match[1] ? parseInt(match[1]) : 0;
-                const minutes = match[2] ? parseInt(match[2]) : 0;
-                return `${hours} hr ${minutes} min`;
-            }
-        }
-        return 'Invalid duration';
-    }
-    const durationElements = document.querySelectorAll('.duration');
-    durationElements.forEach(element => {
-        const originalText = element.textContent;
-        const formattedText = formatDuration(originalText);
-        element.textContent = `Duration: ${formattedText}`;
-    });
-    const totalDurationElements = document.querySelectorAll('.total-duration');
-    totalDurationElements.forEach(element => {
-        const originalText = element.textContent;
-        const formattedText = formatDuration(originalText);
-        element.textContent = `Total Duration: ${formattedText}`;
-    });
-
-// Format JSON data time ISO 8601 (2023-10-21T13:03:00) to Oct 21, 2023, 1:03 PM
-    function formatTime(iso_time) {
-        const months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'];
-        const dt = new Date(iso_time);
-        const year = dt.getFullYear().toString();
-        const month = months[dt.getMonth()];
-        const day = dt.getDate();
-        const hours = dt.getHours();
-        const minutes = dt.getMinutes();
-        const ampm = hours >= 12 ? 'PM' : 'AM';
-        const formattedHours = hours % 12 || 12;
-        const formattedMinutes = minutes < 10 ? `0${minutes}` : minutes;
-        return `${month} ${day}, ${year}, ${formattedHours}:${formattedMinutes} ${ampm}`;
-    }
-    const timeElements = document.querySelectorAll('.time');
-    timeElements.forEach(element => {
-        const originalText = element.textContent;
-        const formattedText = originalText.split(' - ').map(formatTime).join(' - ');
-        element.textContent = formattedText;
-    });
-
 // Function to format date data ("2024-01-12") to Jan 12, Mon
     function formatDate(dateString) {
         const months = [
@@ -520,49 +528,76 @@ document.addEventListener("DOMContentLoaded", async function () {
     }
 
 
-// Change 0 stop to Non Stop
-    const numStopsElements = document.querySelectorAll(".num-stops");
-    numStopsElements.forEach((element) => {
-        const numStops = element.textContent.trim();
-        if (numStops === "0") {
-            element.textContent = "Stops: Non-stop";
-        } else {
-            element.textContent = `Stops: ${numStops}`;
+// Fill in the flexible-date price matrix as the server streams each date pair
+    async function showFlexCell(cell) {
+        const td = document.querySelector(`.flex-cell[data-depart="${cell.depart_date}"][data-return="${cell.return_date}"]`);
+        if (!td) {
+            return;
         }
-    });
-
-// Convert EUR to USD - Get the exchange rate from API or storage
-    async function getExchangeRate() {
-        const cachedExchangeRate = localStorage.getItem('exchangeRate');
-        if (cachedExchangeRate) {
-            return parseFloat(cachedExchangeRate);
+        td.classList.remove('pending');
+        td.classList.add(cell.status);
+        if (cell.status === 'ok') {
+            // display_price is converted on the server; price stays in the offer currency for comparing cells
+            td.dataset.price = cell.price;
+            td.textContent = cell.display_price;
         } else {
-            try {
-                const response = await fetch('https://api.exchangerate-api.com/v4/latest/EUR');
-                const data = await response.json();
-                const exchangeRate = data.rates.USD;
-                localStorage.setItem('exchangeRate', exchangeRate);
-                return exchangeRate;
-            } catch (error) {
-                console.error('Error fetching exchange rate:', error);
-                return 0;
-            }
+            td.textContent = cell.status === 'empty' ? 'No flights' : 'Unavailable';
         }
     }
 
-    async function convertEURtoUSD(eurAmount) {
-        const cacheExchangeRate = await getExchangeRate();
-        return eurAmount * cacheExchangeRate;
+    function highlightCheapestFlexCell() {
+        const cells = Array.from(document.querySelectorAll('.flex-cell.ok'));
+        cells.forEach(cell => cell.classList.remove('cheapest'));
+        if (cells.length > 0) {
+            cells.reduce((a, b) => parseFloat(a.dataset.price) <= parseFloat(b.dataset.price) ? a : b).classList.add('cheapest');
+        }
     }
 
-    (async () => {
-        const priceElements = document.querySelectorAll('.price');
-        for (let element of priceElements) {
-            const EUR = parseFloat(element.textContent); 
-            const USD = await convertEURtoUSD(EUR); 
-            element.textContent = `Price: $${USD.toFixed(2)} USD`;
+    async function loadFlexMatrix(matrix) {
+        const response = await fetch(`/search/flex?search_id=${encodeURIComponent(matrix.dataset.searchId)}`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! Status: ${response.status}`);
         }
-    })();
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffered = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            buffered += decoder.decode(value || new Uint8Array(), { stream: !done });
+            const lines = buffered.split('\n');
+            buffered = lines.pop();
+            for (const line of lines) {
+                if (line.trim()) {
+                    await showFlexCell(JSON.parse(line));
+                }
+            }
+            highlightCheapestFlexCell();
+            if (done) {
+                break;
+            }
+        }
+        document.querySelectorAll('.flex-cell.pending').forEach(td => {
+            td.classList.remove('pending');
+            td.textContent = 'Unavailable';
+        });
+    }
+
+    const flexMatrix = document.querySelector('.flex-matrix');
+    if (flexMatrix) {
+        loadFlexMatrix(flexMatrix).catch(error => {
+            showFlashMessage('Failed to load flexible dates: ' + error.message, 'error');
+        });
+        flexMatrix.addEventListener('click', function (event) {
+            const td = event.target.closest('.flex-cell.ok');
+            if (td) {
+                const selectForm = document.getElementById('flex-select-form');
+                selectForm.elements['depart_date'].value = td.dataset.depart;
+                selectForm.elements['return_date'].value = td.dataset.return;
+                document.querySelector('.loader').style.display = 'block';
+                selectForm.submit();
+            }
+        });
+    }
 
     document.querySelector('.loader').style.display = 'none';
 });
@@ -0,0 +1,107 @@
+"""Process-wide OAuth token cache for the Amadeus API."""
+import threading
+import time
+
+import requests
+
+from upstream import UpstreamClient
+
+TOKEN_URL = 'https://test.api.amadeus.com/v1/security/oauth2/token'
+
+# Refresh this many seconds before the token actually expires
+REFRESH_MARGIN = 60
+
+# Used when the token response does not include expires_in
+DEFAULT_EXPIRES_IN = 1799
+
+
+class TokenManager:
+    """Cache client-credentials tokens per client id and refresh them ahead of expiry.
+
+    Only one thread refreshes a given client's token at a time. While a refresh
+    is in flight, other threads keep using the current token if it is still
+    valid, and wait for the refresh only when there is no usable token at all.
+    """
+
+    def __init__(self, http=None, token_url=TOKEN_URL, refresh_margin=REFRESH_MARGIN):
+        self.http = http or UpstreamClient()
+        self.token_url = token_url
+        self.refresh_margin = refresh_margin
+        self._tokens = {}  # client_id -> (access_token, expires_at)
+        self._locks = {}
+        self._registry_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'hits': 0, 'refreshes': 0, 'failures': 0}
+
+    def get_token(self, client_id, client_secret):
+        """Return a valid access token for `client_id`, fetching one if needed."""
+        cached = self._tokens.get(client_id)
+        now = time.monotonic()
+        if cached and now < cached[1] - self.refresh_margin:
+            self._count('hits')
+            return cached[0]
+
+        lock = self._lock_for(client_id)
+        if cached and now < cached[1]:
+            # Still valid but close to expiry: refresh if nobody else is, otherwise keep serving it
+            if not lock.acquire(blocking=False):
+                self._count('hits')
+                return cached[0]
+        else:
+            lock.acquire()
+        try:
+            cached = self._tokens.get(client_id)
+            if cached and time.monotonic() < cached[1] - self.refresh_margin:
+                self._count('hits')
+                return cached[0]
+            token = self._refresh(client_id, client_secret)
+            if token:
+                return token
+            if cached and time.monotonic() < cached[1]:
+                return cached[0]
+            return None
+        finally:
+            lock.release()
+
+    def invalidate(self, client_id):
+        """Drop the cached token for `client_id`, e.g. after the API rejected it."""
+        self._tokens.pop(client_id, None)
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats, clients=len(self._tokens))
+
+    def _refresh(self, client_id, client_secret):
+        payload = {
+            'grant_type': 'client_credentials',
+            'client_id': client_id,
+            'client_secret': client_secret
+        }
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        try:
+            response = self.http.post('oauth_token', self.token_url, data=payload, headers=headers)
+        except requests.RequestException as e:
+            print(f"Failed to get token: {e}")
+            self._count('failures')
+            return None
+        if response.status_code != 200:
+            print("Failed to get token")
+            self._count('failures')
+            return None
+        data = response.json()
+        token = data.get('access_token')
+        expires_in = data.get('expires_in') or DEFAULT_EXPIRES_IN
+        self._tokens[client_id] = (token, time.monotonic() + int(expires_in))
+        self._count('refreshes')
+        return token
+
+    def _lock_for(self, client_id):
+        with self._registry_lock:
+            lock = self._locks.get(client_id)
+            if lock is None:
+                lock = self._locks[client_id] = threading.Lock()
+            return lock
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
@@ -0,0 +1,113 @@
+"""Shared HTTP client for the upstream APIs (Amadeus, Visual Crossing, exchange rates).
+
+All calls go through one pooled keep-alive session per worker, with connect/read
+timeouts, bounded retries with backoff on 429/5xx, and a latency histogram per
+endpoint (exported at /metrics). `RateLimiter` keeps a worker under an upstream's request rate limit.
+"""
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import Histogram, record_upstream
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class RateLimiter:
+    """Token bucket shared by every thread calling a rate-limited upstream; a rate of 0 disables it."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.throttled = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Wait for a token; return False if none becomes available within `timeout` seconds."""
+        if self.rate <= 0:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waited = False
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+                if deadline is not None and now + wait > deadline:
+                    self.rejected += 1
+                    return False
+                if not waited:
+                    self.throttled += 1
+                    waited = True
+            time.sleep(wait)
+
+    def stats(self):
+        return {'rate': self.rate, 'burst': self.burst, 'throttled': self.throttled, 'rejected': self.rejected}
+
+
+class UpstreamClient:
+    """Pooled HTTP session with timeouts, retries and per-endpoint latency stats."""
+
+    def __init__(self, pool_size=10, connect_timeout=3.05, read_timeout=20, retries=2, backoff=0.3):
+        self.timeout = (connect_timeout, read_timeout)
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(['GET', 'POST']),
+            respect_retry_after_header=True,
+            raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._latency = {}
+        self._statuses = {}
+        self._lock = threading.Lock()
+
+    def get(self, endpoint, url, **kwargs):
+        return self.request('GET', endpoint, url, **kwargs)
+
+    def post(self, endpoint, url, **kwargs):
+        return self.request('POST', endpoint, url, **kwargs)
+
+    def request(self, method, endpoint, url, **kwargs):
+        """Send a request and record its latency under `endpoint`; raises requests.RequestException."""
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            response = self.session.request(method, url, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            self._record(endpoint, time.perf_counter() - start, status)
+
+    def stats(self):
+        with self._lock:
+            return {endpoint: dict(histogram.as_dict(), statuses=dict(self._statuses[endpoint]))
+                    for endpoint, histogram in self._latency.items()}
+
+    def _record(self, endpoint, elapsed, status):
+        record_upstream(elapsed)
+        with self._lock:
+            histogram = self._latency.get(endpoint)
+            if histogram is None:
+                histogram = self._latency[endpoint] = Histogram()
+                self._statuses[endpoint] = {}
+            statuses = self._statuses[endpoint]
+            statuses[status] = statuses.get(status, 0) + 1
+        histogram.observe(elapsed)
@@ -0,0 +1,95 @@
+"""Server-side weather lookups with a per-location, per-day cache.
+
+Locations are rounded so nearby coordinates share entries, and each day is
+cached on its own so overlapping date ranges reuse what is already known.
+"""
+from datetime import date, timedelta
+
+from cache import MemoryCache
+
+# Decimal places kept from lat/long (2 places is roughly 1 km)
+PRECISION = 2
+
+# Missing days further apart than this are fetched in separate upstream calls
+MAX_GAP_DAYS = 7
+
+MAX_RANGE_DAYS = 366
+
+
+def parse_request(lat_long, start, end):
+    """Validate a weather request; returns (lat, long, start, end) or raises ValueError."""
+    lat, long = (float(part) for part in str(lat_long).split(','))
+    start = date.fromisoformat(str(start)[:10])
+    end = date.fromisoformat(str(end)[:10])
+    if not (-90 <= lat <= 90 and -180 <= long <= 180):
+        raise ValueError('Invalid coordinates')
+    if end < start or (end - start).days > MAX_RANGE_DAYS:
+        raise ValueError('Invalid date range')
+    return lat, long, start, end
+
+
+def _days(start, end):
+    return [start + timedelta(days=n) for n in range((end - start).days + 1)]
+
+
+def _runs(days):
+    """Split sorted days into runs with no gap longer than MAX_GAP_DAYS."""
+    runs = []
+    for day in days:
+        if runs and (day - runs[-1][1]).days <= MAX_GAP_DAYS:
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return runs
+
+
+class WeatherService:
+    """Serve daily weather from the cache, fetching only the missing days upstream.
+
+    `fetch(lat_long, start, end)` must return the Visual Crossing timeline JSON
+    (a dict with a `days` list) or None on failure.
+    """
+
+    def __init__(self, fetch, cache=None, precision=PRECISION):
+        self.fetch = fetch
+        self.cache = cache or MemoryCache(ttl=3 * 60 * 60, max_entries=20000)
+        self.precision = precision
+
+    def location_key(self, lat, long):
+        return f'{lat:.{self.precision}f},{long:.{self.precision}f}'
+
+    def get(self, lat, long, start, end):
+        """Return {'days': [...]} for one location and date range."""
+        return self.get_many([(lat, long, start, end)])[0]
+
+    def get_many(self, queries):
+        """Answer many (lat, long, start, end) requests with one upstream call per location and gap."""
+        wanted = {}  # location -> set of days
+        for lat, long, start, end in queries:
+            wanted.setdefault(self.location_key(lat, long), set()).update(_days(start, end))
+
+        known = {}
+        for location, days in wanted.items():
+            missing = []
+            for day in days:
+                cached = self.cache.get(f'weather:{location}:{day}')
+                if cached is None:
+                    missing.append(day)
+                else:
+                    known[(location, day)] = cached
+            for run_start, run_end in _runs(sorted(missing)):
+                data = self.fetch(location, run_start, run_end)
+                for day_data in (data or {}).get('days', []):
+                    day = date.fromisoformat(day_data['datetime'])
+                    self.cache.set(f'weather:{location}:{day}', day_data)
+                    known[(location, day)] = day_data
+
+        results = []
+        for lat, long, start, end in queries:
+            location = self.location_key(lat, long)
+            days = [known[(location, day)] for day in _days(start, end) if (location, day) in known]
+            results.append({'days': days} if days else None)
+        return results
+
+    def stats(self):
+        return self.cache.stats()